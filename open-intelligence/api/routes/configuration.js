@@ -32,6 +32,8 @@ async function Configuration(router, sequelizeObjects) {
           cameras_root_path: utils.ConfigValue(configurations, 'cameras_root_path', '/input'),
           camera_names: utils.ConfigValue(configurations, 'camera_names', 'HikVision'),
           camera_folders: utils.ConfigValue(configurations, 'camera_folders', '/HikVision/,'),
+          camera_rois: utils.ConfigValue(configurations, 'camera_rois', ''),
+          motion_thresholds: utils.ConfigValue(configurations, 'motion_thresholds', ''),
         },
         openalpr: {
           enabled: utils.ConfigValue(configurations, 'enabled', 'True'),
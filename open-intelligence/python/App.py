@@ -3,7 +3,6 @@
 import os
 import shutil
 import sys
-import time
 import traceback
 from pathlib import Path
 
@@ -11,6 +10,7 @@ import psycopg2
 from filelock import FileLock
 
 import database
+import migrate
 import object_detection
 import service_instance
 from utils import File
@@ -173,11 +173,16 @@ def main_loop():
             print("... running")
         except psycopg2.OperationalError as e:
             print(e)
-        time.sleep(PROCESS_SLEEP_SECONDS)
+        # Detection tasks wake the loop right away, training commands are checked
+        # every sleep interval as before
+        database.wait_for_notification(
+            database.DETECTION_CHANNEL, PROCESS_SLEEP_SECONDS
+        )
 
 
 if __name__ == "__main__":
     try:
+        migrate.apply_migrations()
         main_loop()
     except KeyboardInterrupt:
         print("Exiting by user request.", file=sys.stderr)
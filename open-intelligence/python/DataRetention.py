@@ -5,6 +5,7 @@ import threading
 import psycopg2
 
 import database
+import migrate
 import service_instance
 
 # Config
@@ -35,6 +36,7 @@ def retention_app():
 
         # Do work
         dr_work_records = database.get_data_retention_data(data_retention_days)
+        deleted_ids = []
         for row in dr_work_records:
             # Get db row fields
             id = row[0]
@@ -64,8 +66,10 @@ def retention_app():
                 )
             )
 
-            # update as deleted
-            database.update_data_retention_data_deleted(id)
+            deleted_ids.append(id)
+
+        # update as deleted, in chunks of database.ID_CHUNK_SIZE rows
+        database.update_data_retention_rows_deleted(deleted_ids)
     else:
         print("data retention is disabled")
 
@@ -85,6 +89,7 @@ def main_loop():
 
 if __name__ == "__main__":
     try:
+        migrate.apply_migrations()
         main_loop()
     except KeyboardInterrupt:
         print >> sys.stderr, "\nExiting by user request.\n"
@@ -1,18 +1,22 @@
 import argparse
 import os
-import pickle
 import sys
-import time
 import traceback
 
 import cv2
 import psycopg2
 
 import database
+import migrate
+import model_registry
 from service_instance import instance
 
 from utils import load_image, save_image, crop_image
-from config import INSIGHTFACE_OUTPUT_PATH, OUTPUT_ROOT_PATH, PROCESS_SLEEP_SECONDS
+from config import (
+    INSIGHTFACE_OUTPUT_PATH,
+    OUTPUT_ROOT_PATH,
+    WORK_NOTIFY_TIMEOUT_SECONDS,
+)
 from face_recognition import recognizeSF
 
 # Check does system has GPU support
@@ -25,8 +29,6 @@ model_path = os.path.join(model_root_path, "res10_300x300_ssd_iter_140000.caffem
 
 model_root_path = os.path.join(os.getcwd(), "models/YN-SF")
 yn_model = os.path.join(model_root_path, "face_detection_yunet_2022mar.onnx")
-sf_model = os.path.join(model_root_path, "face_recognition_sface_2021dec.onnx")
-faces_db_path = os.path.join(model_root_path, "faces_db.pickle")
 
 # try:
 #     output_root_folder_path = os.environ['OUTPUT_FOLDER']
@@ -40,7 +42,7 @@ def app(detector, recognizer, label_encoder, batch_size):
 
     if len(work_records) == 0:
         print("No insightFace images to process")
-        return
+        return 0
     for row in work_records:
         # Get db row fields
         id = row[0]
@@ -50,7 +52,9 @@ def app(detector, recognizer, label_encoder, batch_size):
 
         input_image = os.path.join(OUTPUT_ROOT_PATH, label, cropped_file_name)
         if not os.path.exists(input_image):
-            return
+            # Marked so a missing crop does not hold up the rows after it
+            database.update_insight_face_as_computed("", id)
+            continue
 
         try:
             detection_result = detect_and_recognize_faces(
@@ -67,6 +71,8 @@ def app(detector, recognizer, label_encoder, batch_size):
         # Write database, set as computed
         database.update_insight_face_as_computed(detection_result, id)
 
+    return len(work_records)
+
 
 def detect_and_recognize_faces(image_path, file_name, recognizer, detector, faces_db):
     """
@@ -110,18 +116,24 @@ def main_loop(batch_size):
     print("[INFO] loading face detector...")
     detector = cv2.FaceDetectorYN.create(yn_model, "", (320, 320), 0.9, 0.3, 5000)
 
-    recognizer = cv2.FaceRecognizerSF.create(sf_model, "")
-    label_encoder = pickle.loads(open(faces_db_path, "rb").read())
+    # Shared with recognizeSF, served by the inference server when it runs
+    recognizer = model_registry.get("face_embedder")
+    label_encoder = model_registry.get("faces_db")
 
     print("[Info] loaded")
     while 1:
+        handled = 0
         try:
             instance.set_instance_status()
-            app(detector, recognizer, label_encoder, batch_size)
+            handled = app(detector, recognizer, label_encoder, batch_size)
             print("... running")
         except psycopg2.OperationalError as e:
             print(e)
-        time.sleep(int(PROCESS_SLEEP_SECONDS))
+        # A full batch means more rows are waiting, take them right away
+        if handled < database.WORK_BATCH_SIZE:
+            database.wait_for_notification(
+                database.INSIGHT_FACE_CHANNEL, WORK_NOTIFY_TIMEOUT_SECONDS
+            )
 
 
 if __name__ == "__main__":
@@ -137,6 +149,7 @@ if __name__ == "__main__":
 
         args = parser.parse_args()
         print("Using batch size of " + str(args.batch_size))
+        migrate.apply_migrations()
         main_loop(args.batch_size)
     except KeyboardInterrupt:
         print >> sys.stderr, "\nExiting by user request.\n"
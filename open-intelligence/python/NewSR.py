@@ -1,17 +1,16 @@
 import os
 import sys
-import time
 import gc
 from pathlib import Path
-import tensorflow as tf
-import tensorflow_hub as hub
 import cv2
 import numpy as np
 import psycopg2
 
 import database
+import migrate
+import model_registry
 from service_instance import instance as service_instance
-from config import OUTPUT_ROOT_PATH, PROCESS_SLEEP_SECONDS, SR_MAX_HEIGHT, SR_MAX_WIDTH
+from config import OUTPUT_ROOT_PATH, SR_MAX_HEIGHT, SR_MAX_WIDTH, WORK_NOTIFY_TIMEOUT_SECONDS
 from object_detection import add_car_and_people_insights
 from utils import is_null_empty_or_whitespace
 from vehicle_color import vehicle_color_detect
@@ -23,11 +22,21 @@ from srFile import SrFile
 # This is a model of Enhanced Super Resolution GAN Model
 # The link given here is a model of ESRGAN model
 esrgn_path = "https://tfhub.dev/captain-pool/esrgan-tf2/1"
-model = hub.load(esrgn_path)
+
+
+def load_model():
+    import tensorflow_hub as hub
+
+    return hub.load(esrgn_path)
+
+
+model_registry.register("esrgan", load_model)
 
 
 # Model to preprocess the images
 def preprocessing(img):
+    import tensorflow as tf
+
     imageSize = (tf.convert_to_tensor(img.shape[:-1]) // 4) * 4
     cropped_image = tf.image.crop_to_bounding_box(img, 0, 0, imageSize[0], imageSize[1])
     preprocessed_image = tf.cast(cropped_image, tf.float32)
@@ -35,6 +44,9 @@ def preprocessing(img):
 
 
 def srmodel(img):
+    import tensorflow as tf
+
+    model = model_registry.get("esrgan")
     preprocessed_image = preprocessing(img)  # Preprocess the LR Image
     # returns the size of the original argument that is given as input
     return tf.squeeze(model(preprocessed_image)) / 255.0
@@ -92,23 +104,25 @@ def app():
                     use_rotation=True,
                 )
 
-                # Try to detect color
-                try:
-                    sr_image_object.color = vehicle_color_detect.detect_color(
-                        sr_image_object.output_image
-                    )
-                except Exception as e:
-                    print(e)
-
-                # Write database, row no longer processed later
-                database.update_super_resolution_row_result(
-                    sr_image_object.detection_result,
-                    sr_image_object.color,
-                    sr_image_object.image_name,
-                    sr_image_object.id,
+            # Try to detect color
+            try:
+                sr_image_object.color = vehicle_color_detect.detect_color(
+                    sr_image_object.output_image
                 )
-        else:
-            print("No new sr image objects to process")
+            except Exception as e:
+                print(e)
+
+            # Write database, row no longer processed later, whatever the result
+            database.update_super_resolution_row_result(
+                sr_image_object.detection_result,
+                sr_image_object.color,
+                sr_image_object.image_name,
+                sr_image_object.id,
+            )
+    else:
+        print("No new sr image objects to process")
+
+    return len(sr_work_records)
 
 
 def process_super_resolution_images(sr_image_objects, max_width, max_height):
@@ -165,17 +179,23 @@ def process_super_resolution_images(sr_image_objects, max_width, max_height):
 
 def main_loop():
     while 1:
+        handled = 0
         try:
             service_instance.set_instance_status()
-            app()
+            handled = app()
             print("... running")
         except psycopg2.OperationalError as e:
             print(e)
-        time.sleep(int(PROCESS_SLEEP_SECONDS))
+        # A full batch means more rows are waiting, take them right away
+        if handled < database.WORK_BATCH_SIZE:
+            database.wait_for_notification(
+                database.SUPER_RESOLUTION_CHANNEL, WORK_NOTIFY_TIMEOUT_SECONDS
+            )
 
 
 if __name__ == "__main__":
     try:
+        migrate.apply_migrations()
         main_loop()
     except KeyboardInterrupt:
         print >> sys.stderr, "\nExiting by user request.\n"
@@ -1,19 +1,25 @@
 """Main processing of new image files into db with object detection, etc."""
 
+import argparse
+import functools
+import multiprocessing
 import os
 import shutil
+import signal
 import sys
 import time
 import traceback
 from pathlib import Path
 
+import cv2
 import psycopg2
-from filelock import FileLock
 
 import database
 import object_detection
 import service_instance
-from utils import File
+from camera_watcher import CameraFolderWatcher
+from detection_pipeline import DetectionPipeline
+from utils import File, claim_file, is_skipped_file_name, release_file
 from config import (
     CAMERA_FOLDERS_CONFIG,
     CAMERA_NAMES_CONFIG,
@@ -24,9 +30,14 @@ from config import (
     TEST_MOVE_PATH,
 )
 from face_recognition import extract_embeddings, train_model
-from utils import get_time_sorted_files
+from utils import get_oldest_files
 
 MAX_FILES_TO_TAKE = 500
+# Batches a backlog pass takes at most before going back to watching
+MAX_BACKLOG_BATCHES = 100
+# Watch mode rescans the camera folders every this many sleep intervals, frames
+# that failed before or were missed by the watches are retried then
+WATCH_RESCAN_SLEEPS = 15
 
 Path(INSIGHTFACE_OUTPUT_PATH).mkdir(parents=True, exist_ok=True)
 Path(TEST_MOVE_PATH).mkdir(parents=True, exist_ok=True)
@@ -52,27 +63,19 @@ def camera_folder_setup() -> zip:
 
 
 def detect_objects(image_record: File):
-    fqfn = str(
-        os.path.join(
-            image_record.root_path, image_record.file_path, image_record.file_name
-        )
-    )
-    lock_path = fqfn + ".lock"
-    lock = FileLock(lock_path, timeout=1)
+    lock = claim_file(image_record)
+    if lock is None:
+        return
 
-    with lock.acquire():
-        try:
-            object_detection.analyze_image(image_record)
-        except EOFError as e:
-            handle_invalid_image(image_record, e)
-        except Exception as e:
-            print(e)
-            print(traceback.format_exc())
-        finally:
-            lock.release()
-
-    if not lock.is_locked and os.path.exists(lock_path):
-        os.remove(lock_path)
+    try:
+        object_detection.analyze_image(image_record)
+    except EOFError as e:
+        handle_invalid_image(image_record, e)
+    except Exception as e:
+        print(e)
+        print(traceback.format_exc())
+    finally:
+        release_file(lock)
 
 
 """Handle exceptions when processing an image."""
@@ -90,26 +93,99 @@ def handle_invalid_image(sorted_file, error):
     )
 
 
+"""Load the detection model once per worker process."""
+
+
+def init_detection_worker(threads_per_worker):
+    cv2.setNumThreads(threads_per_worker)
+    object_detection.get_yolo_model()
+    # Frames of a camera are spread over the workers, the tracker of a worker
+    # would only see some of them
+    object_detection.OBJECT_TRACKING = False
+    # Pool.terminate sends SIGTERM, exiting cleanly writes the buffered rows
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+
+def create_worker_pool(workers):
+    # Spawned, not forked: OpenCV thread pools are not fork safe
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Starting {workers} detection workers, {threads_per_worker} threads each")
+    if object_detection.OBJECT_TRACKING:
+        print("Object tracking is disabled in detection workers")
+    return multiprocessing.get_context("spawn").Pool(
+        workers, initializer=init_detection_worker, initargs=(threads_per_worker,)
+    )
+
+
+"""Detect objects in a batch of frames, spread over the worker pool when there is one."""
+
+
+def detect_all(image_files, pool=None):
+    if pool is None:
+        for image_file in image_files:
+            # print(f"process_image {image_file}")
+            detect_objects(image_file)
+    else:
+        for _ in pool.imap_unordered(detect_objects, image_files):
+            pass
+
+
 """Main function to process images."""
 
 
-def process_new_images():
+def process_new_images(detect=detect_all):
     camera_folders = camera_folder_setup()
-    image_files = get_time_sorted_files(camera_folders, target_extention=".jpg")[
-        :MAX_FILES_TO_TAKE
-    ]
+    image_files = get_oldest_files(
+        camera_folders, MAX_FILES_TO_TAKE, target_extention=".jpg"
+    )
 
     print(f"Processing {len(image_files)} images")
 
-    for image_file in image_files:
-        # print(f"process_image {image_file}")
-        detect_objects(image_file)
+    detect(image_files)
+
+    return image_files
+
+
+"""Process camera folders until the backlog is smaller than one batch."""
+
+
+def process_backlog(detect=detect_all):
+    previous_batch = None
+    for _ in range(MAX_BACKLOG_BATCHES):
+        image_files = process_new_images(detect)
+        if len(image_files) < MAX_FILES_TO_TAKE:
+            return
+        # Frames that failed to decode or that another instance holds stay in
+        # place, a batch of only those would be taken again and again
+        batch = {(f.file_path, f.file_name) for f in image_files}
+        if batch == previous_batch:
+            print("Backlog pass made no progress, leaving the rest to the next rescan")
+            return
+        previous_batch = batch
+
+
+"""Build a File record for a watched file, None if it is not a new camera image."""
+
+
+def new_image_record(camera_name, camera_folder, file_name):
+    _, extension = os.path.splitext(file_name)
+    if extension != ".jpg" or is_skipped_file_name(file_name):
+        return None
+
+    fqfn = os.path.join(CAMERAS_ROOT_PATH, camera_folder, file_name)
+    try:
+        if os.path.getsize(fqfn) == 0:
+            return None
+        return File(camera_name, "/input", camera_folder, file_name)
+    except (FileNotFoundError, ValueError):
+        # Already processed by a full scan or another instance
+        return None
 
 
 """Main loop to process images and perform tasks."""
 
 
-def main_loop():
+def main_loop(detect=detect_all):
     while True:
         try:
             service_instance.instance.set_instance_status()
@@ -117,16 +193,110 @@ def main_loop():
             # This is have been moved to a seperate micro-services
             # check_for_tasks()
 
-            process_new_images()
+            process_new_images(detect)
             print("... running")
         except psycopg2.OperationalError as e:
             print(e)
         time.sleep(PROCESS_SLEEP_SECONDS)
 
 
+"""Event driven loop, frames are processed as soon as cameras finish writing them."""
+
+
+def watch_loop(detect=detect_all):
+    try:
+        watcher = CameraFolderWatcher(camera_folder_setup(), CAMERAS_ROOT_PATH)
+    except OSError as e:
+        print(f"Camera folder watch unavailable, falling back to polling: {e}")
+        main_loop(detect)
+        return
+
+    try:
+        # Frames written before the watches were added produce no events
+        process_backlog(detect)
+        last_rescan = time.monotonic()
+
+        last_status_update = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_status_update >= PROCESS_SLEEP_SECONDS:
+                    service_instance.instance.set_instance_status()
+                    last_status_update = time.monotonic()
+
+                if (
+                    time.monotonic() - last_rescan
+                    >= WATCH_RESCAN_SLEEPS * PROCESS_SLEEP_SECONDS
+                ):
+                    process_backlog(detect)
+                    last_rescan = time.monotonic()
+
+                events, overflowed = watcher.read_events(PROCESS_SLEEP_SECONDS)
+                if overflowed:
+                    print("Watch event queue overflowed, rescanning camera folders")
+                    process_backlog(detect)
+                    last_rescan = time.monotonic()
+                    continue
+
+                image_records = [
+                    new_image_record(camera_name, camera_folder, file_name)
+                    for camera_name, camera_folder, file_name in events
+                ]
+                detect([r for r in image_records if r is not None])
+            except psycopg2.OperationalError as e:
+                print(e)
+    finally:
+        watcher.close()
+
+
 if __name__ == "__main__":
     try:
-        main_loop()
+        parser = argparse.ArgumentParser(description="New image object detection")
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            dest="watch",
+            help="Process new images as soon as cameras write them (inotify) "
+            "instead of rescanning camera folders every sleep interval",
+        )
+        parser.add_argument(
+            "--workers",
+            dest="workers",
+            type=int,
+            default=1,
+            help="Number of detection worker processes, each loading its own model",
+        )
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            dest="pipeline",
+            help="Overlap frame decoding, inference and result writing in stages",
+        )
+        args = parser.parse_args()
+        if args.pipeline and args.workers > 1:
+            parser.error("--pipeline and --workers can not be combined")
+
+        # docker stop sends SIGTERM, exiting cleanly writes the buffered rows of
+        # frames that were already moved
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+        pool, pipeline, detect = None, None, detect_all
+        if args.workers > 1:
+            pool = create_worker_pool(args.workers)
+            detect = functools.partial(detect_all, pool=pool)
+        elif args.pipeline:
+            pipeline = DetectionPipeline()
+            detect = pipeline.process
+
+        try:
+            if args.watch:
+                watch_loop(detect)
+            else:
+                main_loop(detect)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if pipeline is not None:
+                pipeline.close()
     except KeyboardInterrupt:
         print("Exiting by user request.", file=sys.stderr)
         sys.exit(0)
@@ -7,10 +7,16 @@ import argparse
 import psycopg2
 
 import database
+import migrate
 from srFile import SrFile
 from utils import process_image_objects
 from service_instance import instance as service_instance
-from config import PROCESS_SLEEP_SECONDS, OUTPUT_ROOT_PATH, IMAGE_SIMILARITY_THRESHOLD
+from config import (
+    PROCESS_SLEEP_SECONDS,
+    OUTPUT_ROOT_PATH,
+    IMAGE_SIMILARITY_THRESHOLD,
+    WORK_NOTIFY_TIMEOUT_SECONDS,
+)
 
 
 def create_sr_objects_from_records(records):
@@ -83,7 +89,12 @@ def main_loop(after_date, reverse, threshold, run_once):
             print("... running")
         except psycopg2.OperationalError as e:
             print(e)
-        time.sleep(int(PROCESS_SLEEP_SECONDS))
+        if database.wait_for_notification(
+            database.SIMILARITY_CHANNEL, WORK_NOTIFY_TIMEOUT_SECONDS
+        ):
+            # A pass reads back days of images, rows arriving within the sleep
+            # share one
+            time.sleep(int(PROCESS_SLEEP_SECONDS))
 
 
 if __name__ == "__main__":
@@ -120,6 +131,8 @@ if __name__ == "__main__":
         args = parser.parse_args()
         print(args)
 
+        migrate.apply_migrations()
+
         main_loop(args.after_date, args.r, args.threshold, args.run_once)
 
     except KeyboardInterrupt:
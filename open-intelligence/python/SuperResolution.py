@@ -1,13 +1,18 @@
 import os
 import sys
-import time
 from pathlib import Path
 
 import psycopg2
 
 import database
+import migrate
 from service_instance import instance as service_instance
-from config import OUTPUT_ROOT_PATH, PROCESS_SLEEP_SECONDS, SR_MAX_HEIGHT, SR_MAX_WIDTH
+from config import (
+    OUTPUT_ROOT_PATH,
+    SR_MAX_HEIGHT,
+    SR_MAX_WIDTH,
+    WORK_NOTIFY_TIMEOUT_SECONDS,
+)
 from libraries.fast_srgan import infer_oi
 from object_detection import add_car_and_people_insights
 from utils import is_null_empty_or_whitespace
@@ -85,6 +90,8 @@ def app():
     else:
         print("No new sr image objects to process")
 
+    return len(sr_work_records)
+
 
 # ---------------------------------------------------------------------
 # Keeps program running
@@ -92,17 +99,23 @@ def app():
 
 def main_loop():
     while 1:
+        handled = 0
         try:
             service_instance.set_instance_status()
-            app()
+            handled = app()
             print("... running")
         except psycopg2.OperationalError as e:
             print(e)
-        time.sleep(int(PROCESS_SLEEP_SECONDS))
+        # A full batch means more rows are waiting, take them right away
+        if handled < database.WORK_BATCH_SIZE:
+            database.wait_for_notification(
+                database.SUPER_RESOLUTION_CHANNEL, WORK_NOTIFY_TIMEOUT_SECONDS
+            )
 
 
 if __name__ == "__main__":
     try:
+        migrate.apply_migrations()
         main_loop()
     except KeyboardInterrupt:
         print >> sys.stderr, "\nExiting by user request.\n"
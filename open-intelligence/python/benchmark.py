@@ -0,0 +1,666 @@
+"""Micro benchmarks for the image processing hot paths.
+
+Usage: python benchmark.py <benchmark> [options]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _strace_counts(argv):
+    """Run argv under strace -c, returns (total syscalls, stat family syscalls)."""
+    if shutil.which("strace") is None:
+        return None
+    with tempfile.NamedTemporaryFile(suffix=".strace") as summary:
+        subprocess.run(
+            ["strace", "-f", "-c", "-o", summary.name] + argv,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        total, stats = 0, 0
+        for line in open(summary.name):
+            fields = line.split()
+            if len(fields) < 5 or not fields[3].isdigit():
+                continue
+            if fields[-1] == "total":
+                total = int(fields[3])
+            elif "stat" in fields[-1]:
+                stats += int(fields[3])
+        return total, stats
+
+
+# ---------------------------------------------------------------------
+# Directory indexing
+
+
+def _make_camera_folder(path, count):
+    start = datetime(2024, 12, 27, 10, 30, 16)
+    for i in range(count):
+        dt = start + timedelta(milliseconds=250 * i)
+        stamp = dt.strftime("%Y%m%d%H%M%S") + f"{dt.microsecond // 1000:03d}"
+        with open(os.path.join(path, f"Curbside_00_{stamp}_{i}.jpg"), "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
+
+
+def _legacy_index(path):
+    """Reference copy of the listdir + isdir + getsize + exists + getmtime indexer."""
+    from utils import is_skipped_file_name
+
+    records = []
+    for file_name in os.listdir(path):
+        fqfn = os.path.join(path, file_name)
+        if (
+            os.path.isdir(fqfn)
+            or is_skipped_file_name(file_name)
+            or os.path.getsize(fqfn) == 0
+        ):
+            continue
+        if not os.path.exists(fqfn):
+            continue
+        if re.search("_\\d{17}_", file_name):
+            dt = datetime.strptime(file_name.split("_")[2], "%Y%m%d%H%M%S%f")
+        else:
+            dt = datetime.fromtimestamp(os.path.getmtime(fqfn))
+        records.append((dt, file_name))
+    records.sort()
+    return records
+
+
+def _scandir_index(path):
+    from utils import File, scan_images
+
+    root_path, folder = os.path.split(path)
+    records = [
+        File("benchmark", root_path, folder, entry.file_name, entry.mtime)
+        for entry in scan_images(path)
+    ]
+    records.sort(key=lambda record: record.time_stamp)
+    return records
+
+
+_INDEXERS = {"legacy": _legacy_index, "scandir": _scandir_index}
+
+
+def benchmark_index(args):
+    if args.variant:
+        # Child process for the strace summary, the baseline run only pays for
+        # interpreter start up and imports so they can be subtracted
+        import utils  # noqa: F401
+
+        if args.variant != "baseline":
+            _INDEXERS[args.variant](args.path)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="oi_index_")
+    try:
+        path = os.path.join(work_dir, "camera")
+        os.mkdir(path)
+        _make_camera_folder(path, args.files)
+        per_10k = 10000 / args.files
+        baseline = _strace_counts(
+            [sys.executable, __file__, "index", "--variant", "baseline", "--path", path]
+        )
+
+        for variant, indexer in _INDEXERS.items():
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                indexed = len(indexer(path))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            line = f"{variant:>8}: {indexed} files, {best * per_10k * 1000:.1f} ms / 10k files"
+            counts = _strace_counts(
+                [
+                    sys.executable,
+                    __file__,
+                    "index",
+                    "--variant",
+                    variant,
+                    "--path",
+                    path,
+                ]
+            )
+            if counts is not None:
+                total, stats = (a - b for a, b in zip(counts, baseline))
+                line += f", {total * per_10k:.0f} syscalls ({stats * per_10k:.0f} stat) / 10k files"
+            print(line)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+# ---------------------------------------------------------------------
+# YOLO output decoding
+
+
+def _legacy_process_yolo_output(input_image, yolo_outputs):
+    """Reference copy of the row by row YOLO output decoding loop."""
+    import cv2
+    import numpy as np
+
+    from config import (
+        CONFIDENCE_THRESHOLD,
+        INPUT_DIMENSIONS,
+        NMS_THRESHOLD,
+        SCORE_START_INDEX,
+        YOLO_KEEP_IDS,
+        YOLO_VERSION,
+    )
+    from object_detection import scale_bounding_box
+
+    class_ids, confidences, boxes, original_boxes = [], [], [], []
+    image_height, image_width = input_image.shape[:2]
+    x_factor, y_factor = (
+        image_width / INPUT_DIMENSIONS[0],
+        image_height / INPUT_DIMENSIONS[1],
+    )
+    for output in yolo_outputs:
+        for row in output[0] if YOLO_VERSION == 8 else output:
+            scores = row[SCORE_START_INDEX:]
+            class_id = np.argmax(scores)
+            confidence = scores[class_id]
+            if class_id not in YOLO_KEEP_IDS or confidence <= CONFIDENCE_THRESHOLD:
+                continue
+            confidences.append(float(confidence))
+            class_ids.append(class_id)
+            boxes.append(scale_bounding_box(row[:4], 1.0, 1.0))
+            original_boxes.append(scale_bounding_box(row[:4], x_factor, y_factor))
+
+    indices = cv2.dnn.NMSBoxes(boxes, confidences, CONFIDENCE_THRESHOLD, NMS_THRESHOLD)
+    return class_ids, indices, boxes, original_boxes
+
+
+def _synthetic_yolo_output(rng, detections):
+    """YOLOv8 shaped (1, 8400, 84) output with a number of confident rows."""
+    import numpy as np
+
+    output = rng.random((1, 8400, 84), dtype=np.float32) * np.float32(0.4)
+    output[0, :, :4] = rng.random((8400, 4), dtype=np.float32) * 640
+    rows = rng.integers(0, 8400, detections)
+    output[0, rows, rng.integers(4, 84, detections)] = rng.random(
+        detections, dtype=np.float32
+    )
+    return output
+
+
+def benchmark_yolo_decode(args):
+    import numpy as np
+
+    from object_detection import process_yolo_output
+
+    rng = np.random.default_rng(0)
+    image = np.zeros((args.height, args.width, 3), np.uint8)
+    outputs = [
+        (_synthetic_yolo_output(rng, args.detections),) for _ in range(args.frames)
+    ]
+
+    timings = {}
+    for name, decode in (
+        ("legacy", _legacy_process_yolo_output),
+        ("vectorized", process_yolo_output),
+    ):
+        results = []
+        start = time.perf_counter()
+        for yolo_outputs in outputs:
+            results.append(decode(image, yolo_outputs))
+        timings[name] = (time.perf_counter() - start) / args.frames
+        print(f"{name:>10}: {timings[name] * 1000:.2f} ms / frame")
+
+        if name == "legacy":
+            expected = results
+        else:
+            for a, b in zip(expected, results):
+                assert a[0] == b[0] and a[2] == b[2] and a[3] == b[3], "mismatch"
+                assert list(a[1]) == list(b[1]), "NMS indices mismatch"
+
+    print(
+        f"speedup: {timings['legacy'] / timings['vectorized']:.1f}x, results identical"
+    )
+
+
+# ---------------------------------------------------------------------
+# JPEG decoding
+
+
+def _decode_full(fqfn):
+    """Reference copy of the full decode plus the unused 0.4x resize."""
+    import cv2
+
+    image = cv2.imread(fqfn)
+    cv2.resize(image.copy(), None, fx=0.4, fy=0.4)
+    return image
+
+
+def _decode_reduced(fqfn):
+    from config import INPUT_DIMENSIONS
+    from utils import load_reduced_image
+
+    image, _ = load_reduced_image(fqfn, *INPUT_DIMENSIONS)
+    return image
+
+
+_DECODERS = {"full": _decode_full, "reduced": _decode_reduced}
+
+
+def _make_jpeg(fqfn, width, height):
+    import cv2
+    import numpy as np
+
+    # Smooth random texture compresses and decodes like a camera frame, unlike noise
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.imwrite(fqfn, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+def benchmark_decode(args):
+    if args.variant:
+        # Child process, peak RSS is per process so every variant gets its own.
+        # The baseline run only pays for interpreter start up and imports.
+        import resource
+
+        import utils  # noqa: F401
+        from config import INPUT_DIMENSIONS  # noqa: F401
+
+        elapsed = 0.0
+        if args.variant != "baseline":
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                image = _DECODERS[args.variant](args.path)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print(f"shape {image.shape[1]}x{image.shape[0]}", file=sys.stderr)
+        print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        return
+
+    def run(variant, path):
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "decode",
+                "--variant",
+                variant,
+                "--path",
+                path,
+                "--repeat",
+                str(args.repeat),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        return float(output[0]), int(output[1])
+
+    work_dir = tempfile.mkdtemp(prefix="oi_decode_")
+    try:
+        path = args.image
+        if path is None:
+            path = os.path.join(work_dir, "frame.jpg")
+            _make_jpeg(path, args.width, args.height)
+        _, baseline_rss = run("baseline", path)
+
+        timings = {}
+        for variant in _DECODERS:
+            timings[variant], rss = run(variant, path)
+            # ru_maxrss is in kilobytes on Linux
+            print(
+                f"{variant:>8}: {timings[variant] * 1000:.1f} ms / frame, "
+                f"peak RSS +{(rss - baseline_rss) / 1024:.1f} MB"
+            )
+        print(f"speedup: {timings['full'] / timings['reduced']:.1f}x")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+# ---------------------------------------------------------------------
+# Per frame allocations of the write stage
+
+
+def _legacy_extract_and_process_objects(
+    image_object, image_fullsize, class_ids, indices, boxes, original_boxes
+):
+    """Reference copy of the frame copy, crop copy and random colors version."""
+    import cv2
+    import numpy as np
+
+    import object_detection
+    from utils import clip_negative_values, is_label_ignored
+
+    output_filename = image_object.file_name_from_datetime()
+    font = cv2.FONT_HERSHEY_PLAIN
+    colors = np.random.uniform(0, 255, size=(len(class_ids), 3))
+    clean_image = image_fullsize.copy()
+    for i in indices:
+        x, y, w, h = clip_negative_values(boxes[i])
+        x_, y_, w_, h_ = clip_negative_values(original_boxes[i])
+
+        cropped_image = clean_image[y_ : y_ + h_, x_ : x_ + w_].copy()
+        label = object_detection.class_label(class_ids[i])
+        color = colors[i]
+
+        cv2.rectangle(image_fullsize, (x_, y_), (x_ + w_, y_ + h_), color, 1)
+        cv2.putText(image_fullsize, label, (x_, y_ + 20), font, 2, color, 2)
+
+        if not is_label_ignored(label):
+            object_detection.save_detected_object(
+                image_object, label, cropped_image, output_filename, i
+            )
+            if boxes:
+                object_detection.save_image(image_object.file_name, image_fullsize)
+                return True
+    return False
+
+
+class _BenchmarkFrame:
+    name = "benchmark"
+    file_name = "benchmark.jpg"
+    file_extension = ".jpg"
+
+    def file_name_from_datetime(self):
+        return "benchmark"
+
+
+def benchmark_alloc(args):
+    import tracemalloc
+
+    import numpy as np
+
+    import object_detection
+    from utils import is_label_ignored
+
+    # Only the in memory work is measured, crops and frames are not written
+    object_detection.save_detected_object = lambda *args: None
+    object_detection.process_detected_objects = lambda *args: None
+    object_detection.save_image = lambda *args: None
+
+    labels = [
+        class_id
+        for class_id in sorted(object_detection.YOLO_KEEP_IDS)
+        if not is_label_ignored(object_detection.class_label(class_id))
+    ]
+    image = np.zeros((args.height, args.width, 3), np.uint8)
+    class_ids = [labels[i % len(labels)] for i in range(args.detections)]
+    boxes = [(40 * i, 30 * i, 200, 400) for i in range(args.detections)]
+    detections = (class_ids, list(range(args.detections)), boxes, boxes)
+    frame = _BenchmarkFrame()
+
+    peaks = {}
+    for name, extract in (
+        ("legacy", _legacy_extract_and_process_objects),
+        ("views", object_detection.extract_and_process_objects),
+    ):
+        extract(frame, image, *detections)  # warm up, fills the overlay buffer
+        peak = 0
+        for _ in range(args.frames):
+            # Restarted per frame, reset_peak needs Python 3.9 and the images run 3.8
+            tracemalloc.start()
+            extract(frame, image, *detections)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        peaks[name] = peak
+        print(f"{name:>8}: peak {peak / 1024:.1f} KiB allocated / frame")
+
+    budget = args.budget_kib * 1024
+    assert (
+        peaks["views"] <= budget
+    ), f"{peaks['views'] / 1024:.1f} KiB / frame exceeds the {args.budget_kib} KiB budget"
+    print(f"within the {args.budget_kib} KiB / frame budget")
+
+
+# ---------------------------------------------------------------------
+# Import time
+
+ENTRY_POINTS = [
+    "New_image_object_detection",
+    "App",
+    "SuperResolution",
+    "NewSR",
+    "InsightFace",
+    "SimilarityProcess",
+    "DataRetention",
+    "StreamGrab",
+    "VideoApp",
+]
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def _import_time(module):
+    """
+    Import module under python -X importtime.
+
+    Returns:
+        tuple: (seconds, [(seconds, direct import)]), None when the import failed.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        print(f"{module}: import failed, {result.stderr.strip().splitlines()[-1]}")
+        return None
+
+    # Lines come children first, a top level import ends its group
+    children = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        seconds, depth, name = int(match[2]) / 1e6, len(match[3]), match[4]
+        if depth == 3:
+            children.append((seconds, name))
+        elif depth == 1:
+            if name == module:
+                return seconds, sorted(children, reverse=True)
+            children = []
+    return None
+
+
+def benchmark_importtime(args):
+    over_budget, failed = [], []
+    for module in args.modules:
+        runs = [_import_time(module) for _ in range(args.repeat)]
+        runs = [run for run in runs if run is not None]
+        if not runs:
+            failed.append(module)
+            continue
+        seconds, children = min(runs)
+        print(f"{module:>28}: {seconds:.2f} s")
+        for child_seconds, child in children[: args.top]:
+            print(f"{'':>30}{child_seconds:6.2f} s {child}")
+        if seconds > args.budget_seconds:
+            over_budget.append(module)
+
+    assert not failed, f"{', '.join(failed)} failed to import"
+    assert (
+        not over_budget
+    ), f"{', '.join(over_budget)} over the {args.budget_seconds} s import budget"
+    print(f"all within the {args.budget_seconds} s import budget")
+
+
+# ---------------------------------------------------------------------
+# Inference server throughput
+
+
+def benchmark_inference(args):
+    import threading
+
+    import numpy as np
+
+    import inference_client
+    import inference_server
+
+    blob = np.random.default_rng(0).random((1, 3, 640, 640), dtype=np.float32)
+    inference_client.socket_path = os.path.join(tempfile.mkdtemp(), "inference.sock")
+
+    def client():
+        for _ in range(args.requests):
+            inference_client.call(args.model, "forward", blob)
+        inference_client.close_connection()
+
+    for max_batch in (1, args.max_batch):
+        server = inference_server.serve(
+            inference_client.socket_path,
+            max_batch,
+            args.max_latency_ms,
+            preload=[args.model],
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        inference_client.call(args.model, "forward", blob)  # warm up
+
+        clients = [threading.Thread(target=client) for _ in range(args.clients)]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        frames = args.clients * args.requests
+        print(
+            f"max batch {max_batch:>3}: {frames / elapsed:.1f} frames/s, "
+            f"{elapsed / args.requests * 1000:.1f} ms per request and client"
+        )
+        server.shutdown()
+        server.server_close()
+        inference_client.close_connection()
+
+
+# ---------------------------------------------------------------------
+# Database inserts
+
+
+def benchmark_db_insert(args):
+    import psycopg2
+
+    import database
+
+    file_name = "oi-benchmark-insert.jpg"
+    row = ("benchmark", "car", "/benchmark/", file_name, datetime.now())
+    row += ("benchmark_0.jpg", "", "")
+    pooled = (database.get_connection, database.release_connection)
+    # What every database function did before the pool
+    per_call = (
+        lambda: psycopg2.connect(database.params),
+        lambda connection: connection.close(),
+    )
+    try:
+        for name, (get, release) in (
+            ("connect per call", per_call),
+            ("pooled", pooled),
+        ):
+            database.get_connection, database.release_connection = get, release
+            start = time.perf_counter()
+            for _ in range(args.rows):
+                database.insert_value(*row)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>16}: {args.rows / elapsed:.0f} inserts/s")
+
+        # Rows of detections as object_detection queues them
+        writer = database.BufferedInserter(
+            database.DATA_INSERT_QUERY, args.batch_rows, flush_ms=60000
+        )
+        record = database.data_record(row)
+        start = time.perf_counter()
+        futures = []
+        for _ in range(args.rows):
+            futures += writer.add([record])
+        writer.flush()
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+        print(f"{'buffered':>16}: {args.rows / elapsed:.0f} inserts/s")
+    finally:
+        database.get_connection, database.release_connection = pooled
+        database.delete_rows_with_file_name(file_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open Intelligence benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    index_parser = subparsers.add_parser(
+        "index", help="Camera folder indexing, listdir + stat vs single scandir pass"
+    )
+    index_parser.add_argument("--files", type=int, default=10000)
+    index_parser.add_argument("--repeat", type=int, default=5)
+    index_parser.add_argument(
+        "--variant", choices=["baseline", *_INDEXERS], help=argparse.SUPPRESS
+    )
+    index_parser.add_argument("--path", help=argparse.SUPPRESS)
+    index_parser.set_defaults(func=benchmark_index)
+
+    yolo_parser = subparsers.add_parser(
+        "yolo-decode", help="YOLO output decoding, per row loop vs whole array"
+    )
+    yolo_parser.add_argument("--frames", type=int, default=50)
+    yolo_parser.add_argument("--detections", type=int, default=200)
+    yolo_parser.add_argument("--width", type=int, default=3840)
+    yolo_parser.add_argument("--height", type=int, default=2160)
+    yolo_parser.set_defaults(func=benchmark_yolo_decode)
+
+    decode_parser = subparsers.add_parser(
+        "decode", help="Detection input decoding, full size vs reduced JPEG DCT scale"
+    )
+    decode_parser.add_argument("--image", help="JPEG to decode, default synthetic")
+    decode_parser.add_argument("--width", type=int, default=3840)
+    decode_parser.add_argument("--height", type=int, default=2160)
+    decode_parser.add_argument("--repeat", type=int, default=20)
+    decode_parser.add_argument(
+        "--variant", choices=["baseline", *_DECODERS], help=argparse.SUPPRESS
+    )
+    decode_parser.add_argument("--path", help=argparse.SUPPRESS)
+    decode_parser.set_defaults(func=benchmark_decode)
+
+    alloc_parser = subparsers.add_parser(
+        "alloc", help="Write stage allocations per frame, asserts the budget"
+    )
+    alloc_parser.add_argument("--frames", type=int, default=20)
+    alloc_parser.add_argument("--detections", type=int, default=5)
+    alloc_parser.add_argument("--width", type=int, default=3264)
+    alloc_parser.add_argument("--height", type=int, default=2448)
+    alloc_parser.add_argument("--budget-kib", type=int, default=64)
+    alloc_parser.set_defaults(func=benchmark_alloc)
+
+    importtime_parser = subparsers.add_parser(
+        "importtime", help="Import time of the service entry points, asserts the budget"
+    )
+    importtime_parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    importtime_parser.add_argument("--repeat", type=int, default=3)
+    importtime_parser.add_argument("--top", type=int, default=5)
+    importtime_parser.add_argument("--budget-seconds", type=float, default=1.0)
+    importtime_parser.set_defaults(func=benchmark_importtime)
+
+    inference_parser = subparsers.add_parser(
+        "inference",
+        help="Inference server throughput with concurrent clients, unbatched vs batched",
+    )
+    inference_parser.add_argument(
+        "--model", choices=["yolo", "yolo_cascade"], default="yolo"
+    )
+    inference_parser.add_argument("--clients", type=int, default=8)
+    inference_parser.add_argument("--requests", type=int, default=20)
+    inference_parser.add_argument("--max-batch", type=int, default=8)
+    inference_parser.add_argument("--max-latency-ms", type=int, default=10)
+    inference_parser.set_defaults(func=benchmark_inference)
+
+    db_insert_parser = subparsers.add_parser(
+        "db-insert",
+        help="Row inserts per second, connect per call vs pooled vs buffered",
+    )
+    db_insert_parser.add_argument("--rows", type=int, default=1000)
+    db_insert_parser.add_argument("--batch-rows", type=int, default=500)
+    db_insert_parser.set_defaults(func=benchmark_db_insert)
+
+    args = parser.parse_args()
+    args.func(args)
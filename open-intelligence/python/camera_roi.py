@@ -0,0 +1,93 @@
+"""Per camera regions of interest the detector crops frames to before inference."""
+
+import cv2
+import numpy as np
+
+from config import CAMERA_NAMES_CONFIG, CAMERA_ROIS_CONFIG
+
+
+def parse_roi(text):
+    """
+    Parse "x:y x:y ..." normalized points.
+
+    Returns:
+        numpy.ndarray: (n, 2) float array of polygon points, a two point
+        rectangle is expanded to its four corners. None for an empty entry.
+    """
+    points = [tuple(float(v) for v in point.split(":")) for point in text.split()]
+    if not points:
+        return None
+    if len(points) == 2:
+        (x1, y1), (x2, y2) = points
+        points = [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+    if len(points) < 3 or any(len(point) != 2 for point in points):
+        raise ValueError(f"Invalid region of interest: {text}")
+    return np.clip(np.array(points, dtype=np.float64), 0.0, 1.0)
+
+
+CAMERA_ROIS = {
+    name: roi
+    for name, roi in (
+        (name, parse_roi(text))
+        for name, text in zip(CAMERA_NAMES_CONFIG, CAMERA_ROIS_CONFIG)
+    )
+    if roi is not None
+}
+
+
+def roi_fraction(camera):
+    """Width and height of the camera's region bounding rectangle as frame fractions."""
+    roi = CAMERA_ROIS.get(camera)
+    if roi is None:
+        return 1.0, 1.0
+    width, height = roi.max(axis=0) - roi.min(axis=0)
+    return (width or 1.0), (height or 1.0)
+
+
+def crop_to_roi(image, camera):
+    """
+    Cut the camera's region of interest out of a frame.
+
+    The frame is cropped to the bounding rectangle of the region, pixels outside a
+    polygon region are blacked out. The crop is a view of the frame unless it had
+    to be masked.
+
+    Returns:
+        tuple: (cropped image, (x offset, y offset) of the crop in the frame)
+    """
+    roi = CAMERA_ROIS.get(camera)
+    if roi is None:
+        return image, (0, 0)
+
+    height, width = image.shape[:2]
+    points = np.round(roi * (width - 1, height - 1)).astype(np.int32)
+    x, y, w, h = cv2.boundingRect(points)
+    if w == 0 or h == 0:
+        return image, (0, 0)
+
+    cropped = image[y : y + h, x : x + w]
+    points -= (x, y)
+    if not is_rectangle(points):
+        mask = np.zeros((h, w), np.uint8)
+        cv2.fillPoly(mask, [points], 255)
+        cropped = cv2.bitwise_and(cropped, cropped, mask=mask)
+    return cropped, (x, y)
+
+
+def is_rectangle(points):
+    """True when the points are the four corners of an axis aligned rectangle."""
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    return len(points) == 4 and len(set(xs)) <= 2 and len(set(ys)) <= 2
+
+
+def offset_detections(detections, offset):
+    """Move the full size boxes of a cropped frame back to frame coordinates."""
+    x_offset, y_offset = offset
+    if x_offset == 0 and y_offset == 0:
+        return detections
+    class_ids, indices, boxes, original_boxes = detections
+    original_boxes = [
+        (left + x_offset, top + y_offset, width, height)
+        for left, top, width, height in original_boxes
+    ]
+    return class_ids, indices, boxes, original_boxes
@@ -0,0 +1,111 @@
+"""Inotify based watcher reporting finished camera image files as they arrive."""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from typing import Iterable, List, Tuple
+
+# Event masks from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_BUFFER_SIZE = 64 * 1024
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available on this platform")
+    return libc
+
+
+class CameraFolderWatcher:
+    """Watches camera folders for IN_CLOSE_WRITE / IN_MOVED_TO events.
+
+    Events are reported as (camera name, camera folder, file name) tuples once the
+    camera has finished writing the file, or it has been moved into the folder.
+    """
+
+    def __init__(self, names_folders: Iterable[Tuple[str, str]], root_path):
+        self._libc = _load_libc()
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self.watches = {}
+        try:
+            for name, folder in names_folders:
+                path = os.path.join(root_path, folder)
+                wd = self._libc.inotify_add_watch(
+                    self.fd, os.fsencode(path), WATCH_MASK
+                )
+                if wd < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno), path)
+                self.watches[wd] = (name, folder)
+                print(f"Watching camera {name} at {path}")
+        except OSError:
+            self.close()
+            raise
+
+    def read_events(self, timeout: float) -> Tuple[List[Tuple[str, str, str]], bool]:
+        """
+        Wait up to timeout seconds for new files.
+
+        Returns:
+            tuple: List of (name, folder, file_name) and a flag telling whether the
+            kernel event queue overflowed, in which case events have been lost and
+            the caller has to rescan the folders.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return [], False
+
+        events = []
+        overflowed = False
+        while True:
+            try:
+                buffer = os.read(self.fd, _READ_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            if not buffer:
+                break
+
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buffer):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset : offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    # Watched folder was removed or unmounted
+                    camera = self.watches.pop(wd, None)
+                    if camera is not None:
+                        print(f"Camera folder for {camera[0]} is no longer watched")
+                    continue
+                if mask & IN_ISDIR or wd not in self.watches or not name:
+                    continue
+
+                camera_name, camera_folder = self.watches[wd]
+                events.append((camera_name, camera_folder, os.fsdecode(name)))
+
+        return events, overflowed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
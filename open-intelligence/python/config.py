@@ -20,6 +20,12 @@ USE_GPU: bool = database.find_config_value(APP_CONFIG, "use_gpu") == "True"
 PROCESS_SLEEP_SECONDS: int = int(
     database.find_config_value(APP_CONFIG, "process_sleep_seconds")
 )
+# Services waiting for work wake on a notification of new pending rows, and after
+# the notify timeout when none came
+WORK_NOTIFY_TIMEOUT_SECONDS: int = int(
+    database.find_config_value(APP_CONFIG, "work_notify_timeout_seconds", "60")
+)
+
 SR_MAX_WIDTH: int = int(database.find_config_value(APP_CONFIG, "max_width"))
 SR_MAX_HEIGHT: int = int(database.find_config_value(APP_CONFIG, "max_height"))
 
@@ -32,6 +38,13 @@ CAMERA_NAMES_CONFIG: List[str] = database.find_config_value(
 CAMERA_FOLDERS_CONFIG: List[str] = database.find_config_value(
     APP_CONFIG, "camera_folders"
 ).split(",")
+# Region of interest per camera, in camera_names order. Points are x:y pairs
+# normalized to 0..1 and separated by spaces, two points are the opposite corners
+# of a rectangle and more make a polygon. An empty entry uses the whole frame.
+# Example for two cameras: "0:0.4 1:1,0.1:0.5 0.9:0.3 1:1 0:1"
+CAMERA_ROIS_CONFIG: List[str] = database.find_config_value(
+    APP_CONFIG, "camera_rois", ""
+).split(",")
 
 # Define paths
 OUTPUT_ROOT_PATH: Path = database.find_config_value(APP_CONFIG, "output_folder")
@@ -60,6 +73,138 @@ INPUT_DIMENSIONS: tuple = (640, 640) if YOLO_VERSION >= 8 else (608, 608)
 NMS_THRESHOLD: float = 0.45
 CONFIDENCE_THRESHOLD: float = 0.5
 
+# Inference engine running the YOLO model: opencv, onnxruntime or openvino.
+# Thread counts of 0 leave the choice to the engine, graph optimization is one of
+# disabled, basic, extended or all and only applies to onnxruntime.
+YOLO_BACKEND: str = database.find_config_value(APP_CONFIG, "yolo_backend", "opencv")
+YOLO_INTRA_OP_THREADS: int = int(
+    database.find_config_value(APP_CONFIG, "yolo_intra_op_threads", "0")
+)
+YOLO_INTER_OP_THREADS: int = int(
+    database.find_config_value(APP_CONFIG, "yolo_inter_op_threads", "0")
+)
+YOLO_GRAPH_OPTIMIZATION: str = database.find_config_value(
+    APP_CONFIG, "yolo_graph_optimization", "all"
+)
+
+# fp32 loads the exported model, int8 and fp16 the variants made by quantize_yolo.py
+YOLO_MODEL_PRECISION: str = database.find_config_value(
+    APP_CONFIG, "yolo_model_precision", "fp32"
+)
+
+# Frames per forward pass in the detection pipeline, a batch is run early once
+# its oldest frame has waited max latency milliseconds
+YOLO_BATCH_SIZE: int = int(
+    database.find_config_value(APP_CONFIG, "yolo_batch_size", "1")
+)
+YOLO_BATCH_MAX_LATENCY_MS: int = int(
+    database.find_config_value(APP_CONFIG, "yolo_batch_max_latency_ms", "50")
+)
+
+# Cascade mode screens frames with a small model and only runs the large one when
+# the small model scores a kept class at or above the escalate confidence, or the
+# camera had detections within the last recent seconds
+YOLO_CASCADE: bool = (
+    database.find_config_value(APP_CONFIG, "yolo_cascade", "False") == "True"
+)
+YOLO_CASCADE_MODEL: str = database.find_config_value(
+    APP_CONFIG, "yolo_cascade_model", "yolov8n"
+)
+YOLO_CASCADE_ESCALATE_CONFIDENCE: float = float(
+    database.find_config_value(APP_CONFIG, "yolo_cascade_escalate_confidence", "0.25")
+)
+YOLO_CASCADE_RECENT_SECONDS: float = float(
+    database.find_config_value(APP_CONFIG, "yolo_cascade_recent_seconds", "30")
+)
+
+# Frames of the tiled cameras are also run as overlapping square tiles of tile size
+# pixels, so far objects are not shrunk away by the resize to the model input
+YOLO_TILED_CAMERAS: Set[str] = {
+    name.strip()
+    for name in database.find_config_value(APP_CONFIG, "yolo_tiled_cameras", "").split(
+        ","
+    )
+    if name.strip()
+}
+YOLO_TILE_SIZE: int = int(
+    database.find_config_value(APP_CONFIG, "yolo_tile_size", "1280")
+)
+YOLO_TILE_OVERLAP: float = float(
+    database.find_config_value(APP_CONFIG, "yolo_tile_overlap", "0.2")
+)
+
+
+# Motion prefilter skips inference for frames where less than the motion threshold
+# fraction of pixels changed by more than the pixel threshold gray levels since the
+# camera's last frame with motion. Thresholds per camera, in camera_names order,
+# override the default, an empty entry keeps it.
+MOTION_FILTER: bool = (
+    database.find_config_value(APP_CONFIG, "motion_filter", "False") == "True"
+)
+MOTION_THRESHOLD: float = float(
+    database.find_config_value(APP_CONFIG, "motion_threshold", "0.005")
+)
+MOTION_THRESHOLDS_CONFIG: List[str] = database.find_config_value(
+    APP_CONFIG, "motion_thresholds", ""
+).split(",")
+MOTION_PIXEL_THRESHOLD: int = int(
+    database.find_config_value(APP_CONFIG, "motion_pixel_threshold", "25")
+)
+
+# Detections of byte identical frames are looked up by content hash instead of
+# running the net again, up to cache size frames are kept
+DETECTION_CACHE: bool = (
+    database.find_config_value(APP_CONFIG, "detection_cache", "False") == "True"
+)
+DETECTION_CACHE_SIZE: int = int(
+    database.find_config_value(APP_CONFIG, "detection_cache_size", "100000")
+)
+DETECTION_CACHE_PATH: Path = os.path.join(
+    OUTPUT_ROOT_PATH, "detection_cache", "detections.sqlite3"
+)
+
+# Object tracking matches detections across frames of a camera, plate and face
+# analysis then runs once per track and again only for a frame whose crop is
+# reanalyze improvement times larger than the one analyzed before
+OBJECT_TRACKING: bool = (
+    database.find_config_value(APP_CONFIG, "object_tracking", "False") == "True"
+)
+TRACKER_IOU_THRESHOLD: float = float(
+    database.find_config_value(APP_CONFIG, "tracker_iou_threshold", "0.3")
+)
+TRACKER_MAX_AGE_SECONDS: float = float(
+    database.find_config_value(APP_CONFIG, "tracker_max_age_seconds", "10")
+)
+TRACKER_REANALYZE_IMPROVEMENT: float = float(
+    database.find_config_value(APP_CONFIG, "tracker_reanalyze_improvement", "1.5")
+)
+
+# Detection rows are inserted in batches, once db write max rows are waiting or the
+# oldest has waited flush milliseconds. A flush time of 0 inserts every frame's rows
+# right away.
+DB_WRITE_MAX_ROWS: int = int(
+    database.find_config_value(APP_CONFIG, "db_write_max_rows", "500")
+)
+DB_WRITE_FLUSH_MS: int = int(
+    database.find_config_value(APP_CONFIG, "db_write_flush_ms", "1000")
+)
+
+# Optional inference server hosting the models of all services once per host, on a
+# Unix socket in the shared output folder. Services load their models locally when
+# it is not running. Requests for a model are batched up to max batch, waiting at
+# most max latency milliseconds for more.
+INFERENCE_SERVER: bool = (
+    database.find_config_value(APP_CONFIG, "inference_server", "False") == "True"
+)
+INFERENCE_SOCKET_PATH: Path = os.path.join(
+    OUTPUT_ROOT_PATH, "inference", "inference.sock"
+)
+INFERENCE_MAX_BATCH: int = int(
+    database.find_config_value(APP_CONFIG, "inference_max_batch", "16")
+)
+INFERENCE_MAX_LATENCY_MS: int = int(
+    database.find_config_value(APP_CONFIG, "inference_max_latency_ms", "10")
+)
 
 YOLO_KEEP_CLASSES: List[str] = [
     "person",
@@ -1,7 +1,16 @@
+import atexit
+import multiprocessing.util
 import os
+import select
+import threading
+import time
+from concurrent.futures import Future
 from datetime import date
 
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+import psycopg2.sql
 
 # # Process arguments
 # parser = ArgumentParser()
@@ -26,9 +35,207 @@ params = "dbname={} user={} password={} host={} port={}".format(
 # connection = psycopg2.connect(params)
 # print(connection.get_backend_pid())
 
+# Connections are pooled per process, DB_POOL_SIZE caps the connections a process
+# keeps open. Callers wait for a free connection when all of them are in use.
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+# Connections idle for longer are checked with SELECT 1 before they are handed out
+HEALTH_CHECK_IDLE_SECONDS = 30
+# Rows a work queue poll returns, a full batch means more are waiting
+WORK_BATCH_SIZE = 10
+# Ids per statement and commit of the batch updates and deletes
+ID_CHUNK_SIZE = int(os.environ.get("DB_ID_CHUNK_SIZE", "1000"))
+
+pool = None
+pool_pid = None
+pool_slots = None
+pool_lock = threading.Lock()
+last_used = {}
+# Pools inherited over fork are kept referenced but never used or closed, closing
+# them would end the parent's sessions
+inherited_pools = []
+
+
+def get_pool():
+    global pool, pool_pid, pool_slots
+    if pool_pid != os.getpid():
+        with pool_lock:
+            if pool_pid != os.getpid():
+                if pool is not None:
+                    inherited_pools.append(pool)
+                    last_used.clear()
+                pool = psycopg2.pool.ThreadedConnectionPool(0, POOL_SIZE, params)
+                pool_slots = threading.BoundedSemaphore(POOL_SIZE)
+                pool_pid = os.getpid()
+    return pool
+
+
+def server_sent_data(connection):
+    # An idle session receives nothing unless the server ended it, a restart or
+    # failover shows as a readable socket without a round trip
+    try:
+        return bool(select.select([connection], [], [], 0)[0])
+    except (OSError, ValueError, psycopg2.InterfaceError):
+        return True
+
+
+def connection_alive(connection):
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        connection.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def get_connection():
+    """
+    Connection from the process pool, give it back with release_connection.
+
+    Every connection is checked before it is handed out, connections the server
+    closed are replaced by new ones. Connecting raises psycopg2.OperationalError
+    like psycopg2.connect when the server is down.
+    """
+    connection_pool = get_pool()
+    pool_slots.acquire()
+    try:
+        while True:
+            connection = connection_pool.getconn()
+            idle = time.monotonic() - last_used.get(id(connection), time.monotonic())
+            if not connection.closed and (
+                (idle < HEALTH_CHECK_IDLE_SECONDS and not server_sent_data(connection))
+                or connection_alive(connection)
+            ):
+                return connection
+            print("Reconnecting a closed database connection")
+            last_used.pop(id(connection), None)
+            connection_pool.putconn(connection, close=True)
+    except Exception:
+        pool_slots.release()
+        raise
+
+
+def release_connection(connection):
+    """
+    Return a get_connection connection to the pool, an open transaction is rolled
+    back and a broken connection is closed.
+    """
+    connection_pool = get_pool()
+    try:
+        if connection.closed:
+            last_used.pop(id(connection), None)
+            connection_pool.putconn(connection, close=True)
+        else:
+            last_used[id(connection)] = time.monotonic()
+            connection_pool.putconn(connection)
+    finally:
+        pool_slots.release()
+
+
+def rollback(connection):
+    # Rolling back a connection the server dropped raises, release closes it
+    if not connection.closed:
+        connection.rollback()
+
+
+# Channels the triggers of migrations/002_notify_pending_work.sql notify when rows
+# become pending for a stage
+DETECTION_CHANNEL = "data_detection"
+SUPER_RESOLUTION_CHANNEL = "data_super_resolution"
+INSIGHT_FACE_CHANNEL = "data_insight_face"
+SIMILARITY_CHANNEL = "data_similarity"
+
+# Notifications arrive on a connection of their own, outside the pool, that stays
+# listening for the life of the process
+listen_connection = None
+listen_pid = None
+listen_channels = set()
+# Failures in a row of the listening connection, the wait after one doubles from
+# LISTEN_RETRY_SECONDS up to LISTEN_RETRY_MAX_SECONDS
+listen_failures = 0
+LISTEN_RETRY_SECONDS = 1
+LISTEN_RETRY_MAX_SECONDS = 8
+
+
+def listen(channels):
+    """
+    Listen on channels.
+
+    Returns:
+        bool: True when listening on a channel started just now, notifications
+        sent before were not received.
+    """
+    global listen_connection, listen_pid
+    started = False
+    if listen_pid != os.getpid() and listen_connection is not None:
+        # Closing the parent's connection would end its session, as for the pool
+        inherited_pools.append(listen_connection)
+        listen_connection = None
+    if (
+        listen_pid != os.getpid()
+        or listen_connection is None
+        or listen_connection.closed
+    ):
+        listen_connection = psycopg2.connect(params)
+        listen_connection.autocommit = True
+        listen_pid = os.getpid()
+        listen_channels.clear()
+    cursor = listen_connection.cursor()
+    for channel in channels:
+        if channel not in listen_channels:
+            cursor.execute(
+                psycopg2.sql.SQL("LISTEN {}").format(psycopg2.sql.Identifier(channel))
+            )
+            listen_channels.add(channel)
+            started = True
+    cursor.close()
+    return started
+
+
+def wait_for_notification(channels, timeout):
+    """
+    Block until one of channels is notified or timeout seconds passed.
+
+    Notifications sent while the caller was busy are kept by the connection and
+    return right away. When listening starts or the connection fails the channels
+    are returned as notified, the caller then polls for work as it did before.
+
+    Returns:
+        set: Channels notified, empty after the timeout.
+    """
+    global listen_failures
+    if isinstance(channels, str):
+        channels = [channels]
+    try:
+        started = listen(channels)
+        listen_failures = 0
+        if started:
+            return set(channels)
+        deadline = time.monotonic() + timeout
+        while True:
+            listen_connection.poll()
+            notified = {n.channel for n in listen_connection.notifies}
+            del listen_connection.notifies[:]
+            notified &= set(channels)
+            if notified:
+                return notified
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return set()
+            select.select([listen_connection], [], [], remaining)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+        print(error)
+        if listen_connection is not None:
+            listen_connection.close()
+        retry = LISTEN_RETRY_SECONDS * 2 ** min(listen_failures, 10)
+        listen_failures += 1
+        time.sleep(min(timeout, retry, LISTEN_RETRY_MAX_SECONDS))
+        return set(channels)
+
 
 def db_connected():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cur = connection.cursor()
         cur.execute("SELECT 1")
@@ -37,11 +244,11 @@ def db_connected():
     except psycopg2.OperationalError:
         return False
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def get_application_config():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -51,17 +258,17 @@ def get_application_config():
         cursor.close()
         return config_records
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
-def find_config_value(configs, key):
+def find_config_value(configs, key, default=None):
     for config in configs:
         if config[0] == key:
             return config[1]
-    return None
+    return default
 
 
 # data table
@@ -102,7 +309,7 @@ def insert_value(
     detection_result,
     color,
 ):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -136,10 +343,178 @@ def insert_value(
         cursor.close()
         # print(count, "Database record inserted")
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
+
+
+# noinspection SqlDialectInspection,SqlNoDataSourceInspection
+DATA_INSERT_QUERY = """ INSERT INTO data (name, label, file_path, file_name, file_create_date, detection_completed, file_name_cropped, detection_result, color) VALUES %s"""
+
+
+def data_record(row):
+    """
+    Record for DATA_INSERT_QUERY from the insert_value arguments, detection_completed
+    is set like insert_value does.
+    """
+    return tuple(row[:5]) + (1,) + tuple(row[5:])
+
+
+# Wait before the one retry of a batch that failed on the connection
+WRITE_RETRY_SECONDS = 1
+
+
+class BufferedInserter:
+    """
+    Collects records for one INSERT ... VALUES %s query and writes them in batches.
+
+    A background thread writes the waiting records with one execute_values
+    statement and one commit once max_rows records wait or the oldest has waited
+    flush_ms milliseconds. Waiting records are also written at process exit, after
+    the batch the thread is writing at that moment. With flush_ms 0 every add is written right away by the caller.
+    """
+
+    def __init__(self, query, max_rows=500, flush_ms=1000):
+        self.query = query + " RETURNING id"
+        self.max_rows = max_rows
+        self.flush_seconds = flush_ms / 1000
+        self.records = []
+        self.futures = []
+        self.first_added = None
+        # True while the thread writes a batch it took
+        self.writing = False
+        self.condition = threading.Condition()
+        self.thread_pid = None
+        atexit.register(self.flush)
+        # Worker processes of multiprocessing skip atexit but run its finalizers
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def add(self, records):
+        """
+        Queue records for writing.
+
+        Returns:
+            list: Future per record, resolving to the id of its inserted row.
+        """
+        futures = [Future() for _ in records]
+        if not records:
+            return futures
+        if self.flush_seconds <= 0:
+            self.write(list(records), futures)
+            return futures
+
+        with self.condition:
+            self.start_thread()
+            if not self.records:
+                self.first_added = time.monotonic()
+            self.records.extend(records)
+            self.futures.extend(futures)
+            if len(self.records) >= self.max_rows:
+                self.condition.notify()
+        return futures
+
+    def start_thread(self):
+        # Threads do not survive a fork, the child starts its own
+        if self.thread_pid != os.getpid():
+            self.thread_pid = os.getpid()
+            threading.Thread(
+                target=self.run, name="buffered-inserter", daemon=True
+            ).start()
+
+    def take(self):
+        records, futures = self.records, self.futures
+        self.records, self.futures = [], []
+        return records, futures
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.records:
+                    self.condition.wait()
+                while len(self.records) < self.max_rows:
+                    timeout = self.first_added + self.flush_seconds - time.monotonic()
+                    if timeout <= 0 or not self.records:
+                        break
+                    self.condition.wait(timeout)
+                records, futures = self.take()
+                self.writing = True
+            try:
+                self.write(records, futures)
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def flush(self):
+        """
+        Write the waiting records now, in the calling thread, and wait for the
+        batch the thread is writing.
+        """
+        with self.condition:
+            records, futures = self.take()
+        self.write(records, futures)
+        # A thread of the parent process is not writing in a forked child
+        if self.thread_pid == os.getpid():
+            with self.condition:
+                self.condition.wait_for(lambda: not self.writing)
+
+    def insert(self, records):
+        """Insert records with one statement and commit, returns their ids."""
+        connection = get_connection()
+        try:
+            cursor = connection.cursor()
+            # One page keeps the returned ids in the order of the records
+            ids = psycopg2.extras.execute_values(
+                cursor, self.query, records, page_size=len(records), fetch=True
+            )
+            connection.commit()
+            cursor.close()
+            return [inserted_id for (inserted_id,) in ids]
+        except psycopg2.DatabaseError:
+            rollback(connection)
+            raise
+        finally:
+            release_connection(connection)
+
+    def write(self, records, futures, retry=True):
+        """
+        Insert records and resolve their futures. A row the database refuses is
+        dropped on its own, a batch that failed on the connection is tried once more.
+        """
+        if not records:
+            return
+        try:
+            ids = self.insert(records)
+        except psycopg2.OperationalError as error:
+            if retry:
+                print(error)
+                print(f"Retrying {len(records)} rows")
+                time.sleep(WRITE_RETRY_SECONDS)
+                self.write(records, futures, retry=False)
+                return
+            print(error)
+            print(f"Dropping {len(records)} rows")
+            for future in futures:
+                future.set_exception(error)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as error:
+            if len(records) == 1:
+                print(error)
+                print(f"Dropping row {records[0]}")
+                futures[0].set_exception(error)
+                return
+            # One bad row fails the statement, the others are still good
+            print(error)
+            print(f"Inserting {len(records)} rows one by one")
+            for record, future in zip(records, futures):
+                self.write([record], [future], retry)
+        except psycopg2.DatabaseError as error:
+            print(error)
+            for future in futures:
+                future.set_exception(error)
+        else:
+            for future, inserted_id in zip(futures, ids):
+                future.set_result(inserted_id)
 
 
 # TODO: once fully ported, this function should be removed.
@@ -158,7 +533,7 @@ def insert_value_old(
     detection_result,
     color,
 ):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -195,42 +570,44 @@ def insert_value_old(
         cursor.close()
         # print(count, "Database record inserted")
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def get_super_resolution_images_to_compute():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # Load specific label image not older than one day from now
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
+        # Pending rows come from the partial index of data_state, see migrations/
         sr_work_query = """
-            SELECT id, label, file_name_cropped, detection_result 
-            FROM data 
-            WHERE 
-                file_create_date > now() - interval '1 day' 
-                AND (label = 'car' OR label = 'truck' OR label = 'bus') 
-                AND sr_image_computed = 0 
-            ORDER BY id ASC 
-            LIMIT 10"""
-
-        cursor.execute(sr_work_query)
+            SELECT d.id, d.label, d.file_name_cropped, d.detection_result
+            FROM data_state s
+            JOIN data d ON d.id = s.data_id
+            WHERE
+                s.file_create_date > now() - interval '1 day'
+                AND s.label IN ('car', 'truck', 'bus')
+                AND s.sr_image_computed = 0
+            ORDER BY s.data_id ASC
+            LIMIT %s"""
+
+        cursor.execute(sr_work_query, (WORK_BATCH_SIZE,))
         sr_work_records = cursor.fetchall()
 
         cursor.close()
         return sr_work_records
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def update_super_resolution_row_result(detection_result, color, sr_image_name, id):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -241,14 +618,14 @@ def update_super_resolution_row_result(detection_result, color, sr_image_name, i
         cursor.close()
         # count = cursor.rowcount
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def bool_run_train_face_model():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -267,41 +644,42 @@ def bool_run_train_face_model():
         cursor.close()
         return bool_run_action
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
         return False
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def get_detection_tasks():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
         detection_work_query = """
-            SELECT id, label, file_name_cropped 
-            FROM data 
-            WHERE 
-                detection_completed = 0 
-                AND detection_result IS NULL 
-                AND file_name_cropped IS NOT NULL
-            ORDER BY id ASC LIMIT 10"""
-
-        cursor.execute(detection_work_query)
+            SELECT d.id, d.label, d.file_name_cropped
+            FROM data_state s
+            JOIN data d ON d.id = s.data_id
+            WHERE
+                s.detection_completed = 0
+                AND d.detection_result IS NULL
+                AND d.file_name_cropped IS NOT NULL
+            ORDER BY s.data_id ASC LIMIT %s"""
+
+        cursor.execute(detection_work_query, (WORK_BATCH_SIZE,))
         detection_work_records = cursor.fetchall()
 
         cursor.close()
         return detection_work_records
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def update_detection_task_result(id, detection_result):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -312,30 +690,25 @@ def update_detection_task_result(id, detection_result):
         cursor.close()
         # count = cursor.rowcount
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
-def get_insight_face_images_to_compute(limit=10):
-    connection = psycopg2.connect(params)
+def get_insight_face_images_to_compute(limit=WORK_BATCH_SIZE):
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
-        # query = """
-        #     SELECT id, label, file_name_cropped, detection_result 
-        #     FROM data 
-        #     WHERE 
-        #         label = 'person' 
-        #         AND (insight_face_computed = 0 OR insight_face_computed is NULL) 
-        #     ORDER BY id ASC """
         query = """
-            SELECT id, label, file_name_cropped, detection_result 
-            FROM data 
-            WHERE 
-                label = 'person' 
-            ORDER BY id ASC """
+            SELECT d.id, d.label, d.file_name_cropped, d.detection_result
+            FROM data_state s
+            JOIN data d ON d.id = s.data_id
+            WHERE
+                s.label = 'person'
+                AND s.insight_face_computed = 0
+            ORDER BY s.data_id ASC """
         if limit > 0:
             query += " LIMIT " + str(limit)
 
@@ -344,14 +717,14 @@ def get_insight_face_images_to_compute(limit=10):
         cursor.close()
         return sr_work_records
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def update_insight_face_as_computed(detection_result, id):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -361,25 +734,27 @@ def update_insight_face_as_computed(detection_result, id):
         cursor.close()
         # count = cursor.rowcount
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def get_images_for_similarity_check_process_after(
     after: str, reverse: bool, limit: int = 0
 ):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         query = """
-            SELECT id, label, file_name_cropped, file_create_date
-            FROM data
-            WHERE 
+            SELECT d.id, d.label, d.file_name_cropped, d.file_create_date
+            FROM data_state s
+            JOIN data d ON d.id = s.data_id
+            WHERE
               -- label in ('car', 'person') AND
-              file_create_date > '"""
-        query += after + """' ORDER BY label, file_create_date """
+              NOT s.deleted
+              AND s.file_create_date > %s
+            ORDER BY s.label, s.file_create_date """
 
         if reverse:
             query += "DESC"
@@ -391,21 +766,21 @@ def get_images_for_similarity_check_process_after(
 
         query += ";"
 
-        cursor.execute(query)
+        cursor.execute(query, (after,))
         records = cursor.fetchall()
         cursor.close()
 
         return records
 
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def update_similarity_check_row_checked(id):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -414,14 +789,14 @@ def update_similarity_check_row_checked(id):
         connection.commit()
         cursor.close()
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def delete_row(id):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -431,14 +806,57 @@ def delete_row(id):
         cursor.close()
         print('Deleted row: {}'.format(id))
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
+
+
+def execute_for_ids(query, ids):
+    """
+    Run query, taking the ids as its only parameter, over ids in chunks of
+    ID_CHUNK_SIZE with one commit per chunk.
+
+    Returns:
+        int: Count of rows affected.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    connection = get_connection()
+    count = 0
+    try:
+        cursor = connection.cursor()
+        for start in range(0, len(ids), ID_CHUNK_SIZE):
+            cursor.execute(query, (ids[start:start + ID_CHUNK_SIZE],))
+            connection.commit()
+            count += cursor.rowcount
+        cursor.close()
+    except psycopg2.DatabaseError as error:
+        rollback(connection)
+        print(error)
+    finally:
+        release_connection(connection)
+    return count
+
+
+def update_similarity_check_rows_checked(ids):
+    # noinspection SqlDialectInspection,SqlNoDataSourceInspection
+    update_query = """UPDATE data SET similarity_checked = 1 WHERE id = ANY(%s)"""
+    return execute_for_ids(update_query, ids)
+
+
+def delete_rows(ids):
+    # noinspection SqlDialectInspection,SqlNoDataSourceInspection
+    delete_query = """DELETE FROM data WHERE id = ANY(%s)"""
+    count = execute_for_ids(delete_query, ids)
+    if count:
+        print('Deleted rows: {}'.format(count))
+    return count
 
 
 def delete_rows_with_file_name(file_name):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -447,14 +865,14 @@ def delete_rows_with_file_name(file_name):
         connection.commit()
         cursor.close()
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def clean_instances():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -464,14 +882,14 @@ def clean_instances():
         connection.commit()
         cursor.close()
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def new_instance(process_name):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -488,16 +906,16 @@ def new_instance(process_name):
 
         return inserted_id
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
         return None
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 # noinspection PyShadowingBuiltins
 def update_instance(id):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -506,14 +924,14 @@ def update_instance(id):
         connection.commit()
         cursor.close()
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def get_labeled_for_training_lp_images():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -546,16 +964,16 @@ def get_labeled_for_training_lp_images():
         cursor.close()
         return concatenated_results
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def insert_offsite_value(
     name, label, file_name, year, month, day, hour, minute, second, file_name_cropped
 ):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -581,15 +999,15 @@ def insert_offsite_value(
 
         return inserted_id
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
         return None
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def get_rejected_offsite_images():
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -604,14 +1022,14 @@ def get_rejected_offsite_images():
         cursor.close()
         return records
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def delete_rejected_offsite_image_record(id):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -625,14 +1043,14 @@ def delete_rejected_offsite_image_record(id):
         cursor.close()
 
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def insert_notification(message):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
 
@@ -652,23 +1070,24 @@ def insert_notification(message):
         cursor.close()
         # print(count, "Database record inserted")
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def get_data_retention_data(days):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
         dr_work_query = """
-            SELECT id, label, file_name, file_name_cropped, sr_image_name 
-            FROM data 
-            WHERE 
-                file_create_date < now() - interval '(%s) day' 
-                AND deleted = false ORDER BY id DESC"""
+            SELECT d.id, d.label, d.file_name, d.file_name_cropped, d.sr_image_name
+            FROM data_state s
+            JOIN data d ON d.id = s.data_id
+            WHERE
+                s.file_create_date < now() - interval '(%s) day'
+                AND NOT s.deleted ORDER BY s.data_id DESC"""
 
         # Variables
         query_params = (days,)
@@ -679,14 +1098,14 @@ def get_data_retention_data(days):
         cursor.close()
         return dr_work_records
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
 
 
 def update_data_retention_data_deleted(id):
-    connection = psycopg2.connect(params)
+    connection = get_connection()
     try:
         cursor = connection.cursor()
         # noinspection SqlDialectInspection,SqlNoDataSourceInspection
@@ -695,7 +1114,13 @@ def update_data_retention_data_deleted(id):
         connection.commit()
         cursor.close()
     except psycopg2.DatabaseError as error:
-        connection.rollback()
+        rollback(connection)
         print(error)
     finally:
-        connection.close()
+        release_connection(connection)
+
+
+def update_data_retention_rows_deleted(ids):
+    # noinspection SqlDialectInspection,SqlNoDataSourceInspection
+    update_query = """UPDATE data SET deleted = true WHERE id = ANY(%s)"""
+    return execute_for_ids(update_query, ids)
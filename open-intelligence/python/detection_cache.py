@@ -0,0 +1,139 @@
+"""Persistent cache of detection results keyed by frame content.
+
+Camera retries and reprocessing runs deliver byte identical frames more than once.
+Their detections are looked up by a hash of the file contents instead of running
+the net again. Entries live in a SQLite file and the least recently used ones are
+evicted once the cache grows past its size.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from config import DETECTION_CACHE_PATH, DETECTION_CACHE_SIZE
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+REPORT_EVERY = 100
+# Eviction runs once per this many inserts, the cache may overshoot until then
+EVICT_EVERY = 100
+
+cache_stats = Counter()
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+
+
+def content_hash(data):
+    """Fast hash of file contents, xxh3 when xxhash is installed, else BLAKE2b."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def cache_key(frame_hash, *context):
+    """
+    Key of a frame's detections. context holds everything besides the frame that
+    the detections depend on, like the model and the camera's region of interest.
+    """
+    context_hash = hashlib.blake2b(repr(context).encode(), digest_size=8).hexdigest()
+    return f"{frame_hash}:{context_hash}"
+
+
+def connection():
+    """SQLite connection of this process, shared by its threads under _lock."""
+    global _connection, _connection_pid
+    if _connection is None or _connection_pid != os.getpid():
+        os.makedirs(os.path.dirname(DETECTION_CACHE_PATH) or ".", exist_ok=True)
+        _connection = sqlite3.connect(
+            DETECTION_CACHE_PATH, timeout=30, check_same_thread=False
+        )
+        # Worker processes share the file
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS detections "
+            "(key TEXT PRIMARY KEY, detections TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        _connection.execute(
+            "CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used)"
+        )
+        _connection.commit()
+        _connection_pid = os.getpid()
+    return _connection
+
+
+def encode_detections(detections):
+    class_ids, indices, boxes, original_boxes = detections
+    return json.dumps(
+        [
+            [int(class_id) for class_id in class_ids],
+            [int(i) for i in indices],
+            [[int(v) for v in box] for box in boxes],
+            [[int(v) for v in box] for box in original_boxes],
+        ]
+    )
+
+
+def decode_detections(text):
+    class_ids, indices, boxes, original_boxes = json.loads(text)
+    return (
+        class_ids,
+        indices,
+        [tuple(box) for box in boxes],
+        [tuple(box) for box in original_boxes],
+    )
+
+
+def get(key):
+    """Cached detections for key, None on a miss."""
+    with _lock:
+        db = connection()
+        row = db.execute(
+            "SELECT detections FROM detections WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            db.execute(
+                "UPDATE detections SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            db.commit()
+
+        cache_stats["hits" if row is not None else "misses"] += 1
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        if lookups % REPORT_EVERY == 0:
+            print(cache_summary())
+    return decode_detections(row[0]) if row is not None else None
+
+
+def put(key, detections):
+    with _lock:
+        db = connection()
+        db.execute(
+            "INSERT OR REPLACE INTO detections (key, detections, last_used) "
+            "VALUES (?, ?, ?)",
+            (key, encode_detections(detections), time.time()),
+        )
+        cache_stats["inserts"] += 1
+        if cache_stats["inserts"] % EVICT_EVERY == 0:
+            evicted = db.execute(
+                "DELETE FROM detections WHERE key IN (SELECT key FROM detections "
+                "ORDER BY last_used LIMIT max(0, (SELECT count(*) FROM detections) - ?))",
+                (DETECTION_CACHE_SIZE,),
+            ).rowcount
+            cache_stats["evictions"] += evicted
+        db.commit()
+
+
+def cache_summary():
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    if not lookups:
+        return "detection cache: idle"
+    return "detection cache: {} lookups, {:.1f}% hits, {} evictions".format(
+        lookups, cache_stats["hits"] / lookups * 100, cache_stats["evictions"]
+    )
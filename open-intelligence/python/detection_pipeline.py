@@ -0,0 +1,186 @@
+"""Pipelined decode -> infer -> write processing of camera frames."""
+
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import object_detection
+from config import YOLO_BATCH_MAX_LATENCY_MS, YOLO_BATCH_SIZE
+from metrics import StageStats
+from utils import claim_file, release_file
+
+
+class DetectionPipeline:
+    """
+    Runs frames through three stages connected by bounded queues.
+
+    Decoder threads claim and decode the next frames ahead of time, the inference
+    stage runs the net back to back on the calling thread, in batches of up to
+    YOLO_BATCH_SIZE frames from any camera, and writer threads do
+    the crop and frame writes, insights, database inserts and source file moves.
+    OpenCV releases the GIL for image codecs and the net forward, so the stages
+    overlap instead of leaving the CPU idle during I/O.
+
+    Object tracking needs the frames of a camera in file_create_date order. Frames
+    leave the decode stage in that order and all frames of a camera are written
+    by the same writer thread, one after the other.
+    """
+
+    def __init__(self, decode_workers=2, write_workers=2, queue_size=8):
+        self.queue_size = queue_size
+        self.decode_workers = decode_workers
+        self.write_workers = write_workers
+        self._decoder = ThreadPoolExecutor(decode_workers, thread_name_prefix="decode")
+        self._writers = [
+            ThreadPoolExecutor(1, thread_name_prefix=f"write{i}")
+            for i in range(write_workers)
+        ]
+        # Camera name -> its writer
+        self._camera_writers = {}
+        # Bounds frames decoded or inferred but not yet written
+        self._write_slots = threading.BoundedSemaphore(queue_size)
+
+    def process(self, image_records):
+        # Stage statistics are reported per batch of frames
+        self.decode_stats = StageStats("decode", self.decode_workers)
+        self.infer_stats = StageStats("infer")
+        self.write_stats = StageStats("write", self.write_workers)
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        start = time.perf_counter()
+
+        image_records = sorted(image_records, key=lambda r: r.file_create_date())
+        decodes = [
+            self._decoder.submit(self._decode, index, image_record, decoded)
+            for index, image_record in enumerate(image_records)
+        ]
+
+        writes = []
+        # Index -> item of the frames decoded before the ones ahead of them
+        early = {}
+        remaining = len(image_records)
+        while remaining:
+            batch, remaining = self._next_batch(
+                decoded, early, len(image_records), remaining
+            )
+            if not batch:
+                continue
+
+            try:
+                with self.infer_stats.measure(len(batch)):
+                    batch_detections = object_detection.infer_images(
+                        [image for _, _, image, _, _ in batch],
+                        [image_record.name for image_record, _, _, _, _ in batch],
+                        [frame_hash for _, _, _, _, frame_hash in batch],
+                    )
+            except Exception as e:
+                print(f"Error in image analysis: {e}")
+                print(traceback.format_exc())
+                for _, lock, _, _, _ in batch:
+                    release_file(lock)
+                continue
+
+            for (image_record, lock, image, scale, _), detections in zip(
+                batch, batch_detections
+            ):
+                self._write_slots.acquire()
+                writes.append(
+                    self._camera_writer(image_record.name).submit(
+                        self._write, image_record, lock, image, scale, detections
+                    )
+                )
+
+        wait(writes)
+        for future in decodes + writes:
+            if future.exception() is not None:
+                print(f"Error in detection pipeline: {future.exception()}")
+        self.print_stats(time.perf_counter() - start)
+
+    def _camera_writer(self, camera):
+        if camera not in self._camera_writers:
+            self._camera_writers[camera] = self._writers[
+                len(self._camera_writers) % len(self._writers)
+            ]
+        return self._camera_writers[camera]
+
+    def _next_batch(self, decoded, early, count, remaining):
+        """
+        Collect up to YOLO_BATCH_SIZE decoded frames, in the order they were
+        submitted.
+
+        The batch is cut short once its first frame has waited
+        YOLO_BATCH_MAX_LATENCY_MS, so a quiet camera is not held back waiting for
+        frames from the others.
+        """
+        batch = []
+        deadline = None
+        while remaining and len(batch) < YOLO_BATCH_SIZE:
+            index = count - remaining
+            if index not in early:
+                try:
+                    if deadline is None:
+                        decoded_index, item = decoded.get()
+                    else:
+                        decoded_index, item = decoded.get(
+                            timeout=max(0.0, deadline - time.monotonic())
+                        )
+                except queue.Empty:
+                    break
+                early[decoded_index] = item
+                continue
+
+            item = early.pop(index)
+            remaining -= 1
+            if item is None:
+                continue
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + YOLO_BATCH_MAX_LATENCY_MS / 1000
+        return batch, remaining
+
+    def _decode(self, index, image_record, decoded):
+        # process() counts one item per frame, whatever happens here
+        item, lock = None, None
+        try:
+            lock = claim_file(image_record)
+            if lock is None:
+                return
+            with self.decode_stats.measure():
+                if object_detection.skip_without_motion(image_record):
+                    image = None
+                else:
+                    image, scale, frame_hash = (
+                        object_detection.load_and_preprocess_image(image_record)
+                    )
+            if image is not None and len(image) > 0:
+                item = (image_record, lock, image, scale, frame_hash)
+        except Exception as e:
+            print(f"Error decoding {image_record}: {e}")
+        finally:
+            try:
+                if item is None and lock is not None:
+                    release_file(lock)
+            finally:
+                decoded.put((index, item))
+
+    def _write(self, image_record, lock, image, scale, detections):
+        try:
+            with self.write_stats.measure():
+                object_detection.write_results(image_record, image, detections, scale)
+        except Exception as e:
+            print(f"Error in image analysis: {e}")
+            print(traceback.format_exc())
+        finally:
+            release_file(lock)
+            self._write_slots.release()
+
+    def print_stats(self, wall_seconds):
+        for stats in (self.decode_stats, self.infer_stats, self.write_stats):
+            print(stats.summary(wall_seconds))
+
+    def close(self):
+        self._decoder.shutdown()
+        for writer in self._writers:
+            writer.shutdown()
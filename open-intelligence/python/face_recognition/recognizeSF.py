@@ -7,8 +7,7 @@ import traceback
 import numpy as np
 import cv2
 
-from retinaface import RetinaFace
-
+import model_registry
 from utils import load_image, save_image
 from config import FILE_NAME_PREFIX, FACES_OUTPUT_PATH, FACES_TRAINING_PATH
 
@@ -20,15 +19,70 @@ models_path = os.getcwd() + "/models/YN-SF/"
 # yn_model_fqfn = model_root_path + 'face_detection_yunet_2023mar_int8bq.onnx'
 yn_model_fqfn = os.path.join(models_path, "face_detection_yunet_2022mar.onnx")
 sf_model_fqfn = os.path.join(models_path, "face_recognition_sface_2021dec.onnx")
-faces_db_fqfn = os.path.join(models_path, "/faces_db.pickle")
+faces_db_fqfn = os.path.join(models_path, "faces_db.pickle")
+
+
+# face detector, recognizer, faces_db and RetinaFace are loaded on first use
+def load_detector():
+    return cv2.FaceDetectorYN.create(yn_model_fqfn, "", (320, 320), 0.9, 0.3, 10)
+
+
+def load_recognizer():
+    return cv2.FaceRecognizerSF.create(sf_model_fqfn, "")
+
+
+def load_faces_db():
+    with open(faces_db_fqfn, "rb") as f:
+        return pickle.loads(f.read())
+
+
+class FaceEmbedder:
+    """SFace recognizer behind one call embedding all faces of an image."""
+
+    def __init__(self):
+        self.recognizer = load_recognizer()
+
+    def features(self, image, faces):
+        """Feature of each face, one row per face."""
+        if len(faces) == 0:
+            return np.empty((0, 128), np.float32)
+        return np.concatenate(
+            [
+                self.recognizer.feature(self.recognizer.alignCrop(image, face))
+                for face in faces
+            ]
+        )
+
 
-# load face detector, recognizer, and faces_db
-# start = timeit.default_timer()
-detector = cv2.FaceDetectorYN.create(yn_model_fqfn, "", (320, 320), 0.9, 0.3, 10)
+def load_faces_db_features():
+    """Feature of the face of each faces_db entry, computed once per process."""
+    embedder = model_registry.get("face_embedder")
+    return [
+        embedder.features(image2, [faces2[1][0]])[0]
+        for (file, name, image2, faces2) in model_registry.get("faces_db")
+    ]
 
-recognizer = cv2.FaceRecognizerSF.create(sf_model_fqfn, "")
-faces_db = pickle.loads(open("./models/YN-SF/faces_db.pickle", "rb").read())
-# end = timeit.default_timer()
+
+class RetinaFaceDetector:
+    """RetinaFace model behind a method the inference server can call."""
+
+    def __init__(self):
+        # retinaface imports TensorFlow, keep that out of import time too
+        from retinaface import RetinaFace
+
+        self.model = RetinaFace.build_model()
+
+    def detect_faces(self, image):
+        from retinaface import RetinaFace
+
+        return RetinaFace.detect_faces(image, model=self.model)
+
+
+model_registry.register("face_detector", load_detector)
+model_registry.register("face_embedder", FaceEmbedder, remote=True)
+model_registry.register("faces_db", load_faces_db)
+model_registry.register("faces_db_features", load_faces_db_features)
+model_registry.register("retinaface", RetinaFaceDetector, remote=True)
 
 
 def recognize(image_path, output_file_name=None):
@@ -49,6 +103,9 @@ def recognize(image_path, output_file_name=None):
         # r = 800 / image.shape[1]
         # dim = (800, int(image.shape[0] * r))
         # image = cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
+        detector = model_registry.get("face_detector")
+        embedder = model_registry.get("face_embedder")
+        faces_db = model_registry.get("faces_db")
         try:
             faces = detect_faces(detector, image, image_path)
         except Exception as e:
@@ -57,8 +114,10 @@ def recognize(image_path, output_file_name=None):
         # if faces[1] is not None:
         # for idx, face in enumerate(faces[1]):
         if faces is not None:
+            # One inference server request for all faces of the crop
+            face_features = embedder.features(image, faces)
             for idx, face in enumerate(faces):
-                tup = best_face_match(image, recognizer, faces_db, face)
+                tup = best_face_match(face_features[idx], faces_db)
                 if tup is not None:
                     (name, conf) = tup
                     detection_name_and_probability = (
@@ -130,7 +189,7 @@ def recognize(image_path, output_file_name=None):
 
 # Customized to suit for insight face
 def recognize_for_insight_face(
-    input_image, input_faces, recognizer, faces_db, image_path
+    input_image, input_faces, embedder, faces_db, image_path
 ):
     # Output field
     detection_name_and_probability = ""
@@ -138,8 +197,9 @@ def recognize_for_insight_face(
     # if input_faces[1] is not None:
     #     for idx, face in enumerate(input_faces[1]):
     if input_faces is not None:
+        face_features = embedder.features(input_image, input_faces)
         for idx, face in enumerate(input_faces):
-            tup = best_face_match(input_image, recognizer, faces_db, face)
+            tup = best_face_match(face_features[idx], faces_db)
             if tup is not None:
                 (name, conf) = tup
                 detection_name_and_probability += (
@@ -149,23 +209,13 @@ def recognize_for_insight_face(
     return detection_name_and_probability
 
 
-def best_face_match(input_image, recognizer, faces_db, face1):
+def best_face_match(face1_feature, faces_db):
     # (file, name, image, faces)
     (matches, names) = initialize(faces_db)
-    for tup in faces_db:
+    faces_db_features = model_registry.get("faces_db_features")
+    for tup, face2_feature in zip(faces_db, faces_db_features):
         (file, name, image2, faces2) = tup
-        face1_align = recognizer.alignCrop(input_image, face1)
-        face2_align = recognizer.alignCrop(image2, faces2[1][0])
-        # Extract features
-        face1_feature = recognizer.feature(face1_align)
-        face2_feature = recognizer.feature(face2_align)
-
-        cosine_score = recognizer.match(
-            face1_feature, face2_feature, cv2.FaceRecognizerSF_FR_COSINE
-        )
-        l2_score = recognizer.match(
-            face1_feature, face2_feature, cv2.FaceRecognizerSF_FR_NORM_L2
-        )
+        cosine_score, l2_score = match_scores(face1_feature, face2_feature)
         if cosine_score >= cs_thresh and l2_score < l2_thresh:
             # break
             matches[name] += 1
@@ -184,6 +234,16 @@ def best_face_match(input_image, recognizer, faces_db, face1):
     return None
 
 
+def match_scores(feature1, feature2):
+    """
+    Cosine and L2 scores of cv2.FaceRecognizerSF.match, computed here rather than
+    by a call to the model per score.
+    """
+    feature1 = feature1.ravel() / np.linalg.norm(feature1)
+    feature2 = feature2.ravel() / np.linalg.norm(feature2)
+    return float(np.dot(feature1, feature2)), float(np.linalg.norm(feature1 - feature2))
+
+
 def initialize(faces_db):
     matches = {}
     names = {}
@@ -219,8 +279,7 @@ def visualize(image, faces, thickness=1):
 
 
 def detect_faces(detector: cv2.FaceDetectorYN, image, image_path):
-
-    retina_faces = RetinaFace.detect_faces(image_path)
+    retina_faces = model_registry.get("retinaface").detect_faces(image)
     if retina_faces:
         return map_result_to_cv2(retina_faces)
     else:
@@ -1,15 +1,14 @@
-import database
-from sklearn.preprocessing import LabelEncoder
-from sklearn.svm import SVC
 import pickle
 import os
 
-# App config
-app_config = database.get_application_config()
-output_root_folder_path = database.find_config_value(app_config, 'output_folder')
+from config import OUTPUT_ROOT_PATH as output_root_folder_path
 
 
 def train_model(cwd_path):
+    # scikit-learn is only needed when training, not when importing this module
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.svm import SVC
+
     # Output paths
     recognizer_output_path = output_root_folder_path + 'faces_models/' + 'recognizer.pickle'
     label_encoder_output_path = output_root_folder_path + 'faces_models/' + 'label_encoder.pickle'
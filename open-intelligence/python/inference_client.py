@@ -0,0 +1,178 @@
+"""Thin client of the inference server, see inference_server.py.
+
+Messages on the Unix socket are a 4 byte big endian header length, a JSON header
+and the raw bytes of the numpy arrays the header refers to. Arrays, numbers,
+strings, lists and dicts can be passed to and returned from remote methods.
+"""
+
+import json
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from config import INFERENCE_SERVER, INFERENCE_SOCKET_PATH
+
+# Cleared by the inference server itself, which has to load its models locally
+enabled = INFERENCE_SERVER
+socket_path = INFERENCE_SOCKET_PATH
+
+HEADER_LENGTH = struct.Struct(">I")
+
+connections = threading.local()
+
+
+def encode(value, arrays):
+    """JSON compatible copy of value, numpy arrays are moved to arrays."""
+    if isinstance(value, np.ndarray):
+        arrays.append(np.ascontiguousarray(value))
+        return {"__array__": len(arrays) - 1}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [encode(item, arrays) for item in value]
+    if isinstance(value, dict):
+        return {str(key): encode(item, arrays) for key, item in value.items()}
+    return value
+
+
+def decode(value, arrays):
+    if isinstance(value, list):
+        return [decode(item, arrays) for item in value]
+    if isinstance(value, dict):
+        if "__array__" in value:
+            return arrays[value["__array__"]]
+        return {key: decode(item, arrays) for key, item in value.items()}
+    return value
+
+
+def send_message(sock, header, arrays):
+    header = dict(
+        header, arrays=[{"dtype": a.dtype.str, "shape": a.shape} for a in arrays]
+    )
+    data = json.dumps(header).encode()
+    sock.sendall(HEADER_LENGTH.pack(len(data)) + data)
+    for array in arrays:
+        sock.sendall(memoryview(array).cast("B"))
+
+
+def receive_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Inference connection closed")
+        received += count
+    return buffer
+
+
+def receive_message(sock):
+    """Next message on sock as (header, arrays)."""
+    (length,) = HEADER_LENGTH.unpack(receive_exactly(sock, HEADER_LENGTH.size))
+    header = json.loads(receive_exactly(sock, length))
+    arrays = []
+    for spec in header.pop("arrays"):
+        dtype = np.dtype(spec["dtype"])
+        size = dtype.itemsize * int(np.prod(spec["shape"]))
+        arrays.append(
+            np.frombuffer(receive_exactly(sock, size), dtype).reshape(spec["shape"])
+        )
+    return header, arrays
+
+
+def get_connection():
+    """Connection of the calling thread, requests on one connection are sequential."""
+    sock = getattr(connections, "sock", None)
+    if sock is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            sock.close()
+            raise
+        connections.sock = sock
+    return sock
+
+
+def close_connection():
+    sock = getattr(connections, "sock", None)
+    if sock is not None:
+        connections.sock = None
+        sock.close()
+
+
+def server_available():
+    """True when the inference server is enabled and accepts connections."""
+    if not enabled:
+        return False
+    try:
+        get_connection()
+        return True
+    except OSError as e:
+        print(f"Inference server at {socket_path} not available: {e}")
+        return False
+
+
+def call(model, method, *args, **kwargs):
+    """Call method of model on the inference server and return its result."""
+    arrays = []
+    header = {
+        "model": model,
+        "method": method,
+        "args": encode(list(args), arrays),
+        "kwargs": encode(kwargs, arrays),
+    }
+    sock = get_connection()
+    try:
+        send_message(sock, header, arrays)
+        header, arrays = receive_message(sock)
+    except OSError:
+        close_connection()
+        raise
+    if "error" in header:
+        raise RuntimeError(f"Inference server {model}.{method}: {header['error']}")
+    return decode(header["result"], arrays)
+
+
+class RemoteModel:
+    """
+    Stand-in for a model hosted by the inference server, method calls run remotely.
+
+    When the server goes away the model is loaded locally with local_loader and
+    the calls continue on the local model.
+    """
+
+    # Requests are batched by the server, a batched forward may still be refused
+    # by the model, object_detection then sets this as for a local model
+    unbatched_frames = 0
+
+    def __init__(self, name, local_loader):
+        self.name = name
+        self.local_loader = local_loader
+        self.local = None
+        self._lock = threading.Lock()
+
+    def load_locally(self, error):
+        with self._lock:
+            if self.local is None:
+                print(f"Inference server failed, loading {self.name} locally: {error}")
+                self.local = self.local_loader()
+        return self.local
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def remote_method(*args, **kwargs):
+            local = self.local
+            if local is None:
+                try:
+                    return call(self.name, method, *args, **kwargs)
+                except OSError as e:
+                    local = self.load_locally(e)
+            return getattr(local, method)(*args, **kwargs)
+
+        return remote_method
@@ -0,0 +1,266 @@
+"""Inference server hosting the models of all services once per host.
+
+Services with inference_server set to True call the models registered as remote
+in model_registry through inference_client instead of loading their own copies.
+Each model has one worker thread, requests of all callers queue there and
+requests with the same input shape are run as one batch. A batch is started once
+it holds max batch requests or its oldest request has waited max latency
+milliseconds.
+
+Usage:
+    python inference_server.py --preload yolo face_embedder
+"""
+
+import argparse
+import os
+import queue
+import socketserver
+import threading
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+import inference_client
+import model_registry
+from config import INFERENCE_MAX_BATCH, INFERENCE_MAX_LATENCY_MS
+
+# Imported for the models they register
+import object_detection
+from face_recognition import recognizeSF
+from libraries.fast_srgan import infer_oi
+from vehicle_color import vehicle_color_detect
+
+# Models and the methods callers may run on them
+SERVED_METHODS = {
+    "yolo": {"forward"},
+    "yolo_cascade": {"forward"},
+    "vehicle_color": {"predict"},
+    "fast_srgan": {"predict"},
+    "face_embedder": {"features"},
+    "retinaface": {"detect_faces"},
+}
+
+# Methods taking a batch along the first axis of their only argument
+BATCHED_METHODS = {"forward", "predict"}
+
+# Keyword arguments that only say how a batched method splits its input, such as
+# Keras predict(x, batch_size=1). Calls passing them are batched without them.
+BATCHING_KWARGS = {"batch_size"}
+
+REPORT_EVERY = 1000
+
+# Requests run one by one after a model refused a batch, before batching is tried
+# again
+BATCH_RETRY_REQUESTS = 1000
+
+
+def split_batch(result, sizes):
+    """Split the result of a batched call back into one result per request."""
+    offsets = np.cumsum(sizes)[:-1]
+    if isinstance(result, (list, tuple)):
+        return [list(parts) for parts in zip(*(np.split(r, offsets) for r in result))]
+    return np.split(result, offsets)
+
+
+class ModelWorker(threading.Thread):
+    """Runs the queued requests of one model, batching those that can be."""
+
+    def __init__(self, model_name, max_batch, max_latency_ms):
+        super().__init__(name=f"inference-{model_name}", daemon=True)
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000
+        self.requests = queue.Queue()
+        self.stats = Counter()
+
+    def submit(self, method, args, kwargs):
+        future = Future()
+        self.requests.put((method, args, kwargs, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            groups = {}
+            for request in batch:
+                method, args, kwargs, _ = request
+                if (
+                    method in BATCHED_METHODS
+                    and len(args) == 1
+                    and isinstance(args[0], np.ndarray)
+                    and set(kwargs) <= BATCHING_KWARGS
+                ):
+                    key = (method, args[0].shape[1:], args[0].dtype.str)
+                else:
+                    key = id(request)
+                groups.setdefault(key, []).append(request)
+
+            try:
+                model = model_registry.get(self.model_name)
+                if model is None:
+                    raise RuntimeError(f"{self.model_name} failed to load")
+            except Exception as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for group in groups.values():
+                self.run_group(model, group)
+
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            if self.stats["batches"] % REPORT_EVERY == 0:
+                print(
+                    "inference {}: {} requests in {} batches, {:.1f} per batch".format(
+                        self.model_name,
+                        self.stats["requests"],
+                        self.stats["batches"],
+                        self.stats["requests"] / self.stats["batches"],
+                    )
+                )
+
+    def run_group(self, model, group):
+        method = group[0][0]
+        unbatched_requests = getattr(model, "unbatched_requests", 0)
+        if len(group) > 1 and unbatched_requests > 0:
+            model.unbatched_requests = max(0, unbatched_requests - len(group))
+        elif len(group) > 1:
+            inputs = [args[0] for _, args, _, _ in group]
+            try:
+                result = getattr(model, method)(np.concatenate(inputs))
+            except Exception as e:
+                print(
+                    f"{self.model_name} refused a batch, running the next "
+                    f"{BATCH_RETRY_REQUESTS} requests one by one: {e}"
+                )
+                model.unbatched_requests = BATCH_RETRY_REQUESTS
+            else:
+                parts = split_batch(result, [len(i) for i in inputs])
+                for (*_, future), part in zip(group, parts):
+                    future.set_result(part)
+                return
+
+        for method, args, kwargs, future in group:
+            try:
+                future.set_result(getattr(model, method)(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    """Serves the requests of one client connection, one at a time."""
+
+    def handle(self):
+        while True:
+            try:
+                header, arrays = inference_client.receive_message(self.request)
+            except OSError:
+                return
+            except Exception as e:
+                # The stream can't be followed past a malformed message, answer
+                # and drop the connection, the client reconnects
+                print(f"Malformed inference request: {e}")
+                self.reply({"error": f"Malformed request: {e}"}, [])
+                return
+
+            response, arrays_out = self.run_request(header, arrays)
+            if not self.reply(response, arrays_out):
+                return
+
+    def run_request(self, header, arrays):
+        """Response to one request, failures are answered with an error."""
+        model_name, method = header.get("model"), header.get("method")
+        try:
+            if method not in SERVED_METHODS.get(model_name, ()):
+                return {"error": f"{model_name}.{method} is not served"}, []
+            future = self.server.workers[model_name].submit(
+                method,
+                inference_client.decode(header["args"], arrays),
+                inference_client.decode(header["kwargs"], arrays),
+            )
+            arrays_out = []
+            result = inference_client.encode(future.result(), arrays_out)
+            return {"result": result}, arrays_out
+        except Exception as e:
+            print(f"{model_name}.{method} failed: {e}")
+            print(traceback.format_exc())
+            return {"error": str(e)}, []
+
+    def reply(self, response, arrays):
+        """Send a response, False when the client is gone."""
+        try:
+            inference_client.send_message(self.request, response, arrays)
+            return True
+        except OSError:
+            return False
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, max_batch, max_latency_ms):
+        self.workers = {
+            name: ModelWorker(name, max_batch, max_latency_ms)
+            for name in SERVED_METHODS
+        }
+        for worker in self.workers.values():
+            worker.start()
+
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        # A socket file left by a server that did not shut down blocks the bind
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, InferenceRequestHandler)
+
+
+def serve(socket_path, max_batch, max_latency_ms, preload=()):
+    # The models hosted here are the local ones, not the server itself
+    inference_client.enabled = False
+    for name in preload:
+        model_registry.get(name)
+
+    server = InferenceServer(socket_path, max_batch, max_latency_ms)
+    print(
+        f"Inference server on {socket_path}, "
+        f"batches of up to {max_batch} within {max_latency_ms} ms"
+    )
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open Intelligence inference server")
+    parser.add_argument(
+        "--preload",
+        nargs="*",
+        choices=sorted(SERVED_METHODS),
+        default=[],
+        help="Models to load at start, the others load on their first request",
+    )
+    parser.add_argument("--max-batch", type=int, default=INFERENCE_MAX_BATCH)
+    parser.add_argument("--max-latency-ms", type=int, default=INFERENCE_MAX_LATENCY_MS)
+    args = parser.parse_args()
+
+    server = serve(
+        inference_client.socket_path, args.max_batch, args.max_latency_ms, args.preload
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(inference_client.socket_path)
@@ -1,12 +1,11 @@
 from argparse import ArgumentParser
 import os
-import tensorflow as tf
-from tensorflow import keras
-from keras import backend as kb
 import numpy as np
 import cv2
 import gc
 
+import model_registry
+
 parser = ArgumentParser()
 parser.add_argument("--image_dir", type=str, help="Directory where images are kept.")
 parser.add_argument(
@@ -16,22 +15,35 @@ parser.add_argument(
 # Model path
 model_path_file_name = os.getcwd() + "/libraries/fast_srgan/models/generator.h5"
 
-# Set Keras TensorFlow session config
-config = tf.compat.v1.ConfigProto()
-config.gpu_options.per_process_gpu_memory_fraction = 0.8  # 1.0 => 100%
-config.gpu_options.allow_growth = True
-tf_session = tf.compat.v1.Session(config=config)
-tf.compat.v1.keras.backend.set_session(tf_session)
 
-# Load model to memory
-# Change model input shape to accept all size inputs
-model = keras.models.load_model(model_path_file_name, compile=False)
-inputs = keras.Input((None, None, 3))
-output = model(inputs)
-model = keras.models.Model(inputs, output)
+def load_model():
+    # TensorFlow is imported with the model, not when this module is imported
+    import tensorflow as tf
+    from tensorflow import keras
+
+    # Set Keras TensorFlow session config
+    config = tf.compat.v1.ConfigProto()
+    config.gpu_options.per_process_gpu_memory_fraction = 0.8  # 1.0 => 100%
+    config.gpu_options.allow_growth = True
+    tf_session = tf.compat.v1.Session(config=config)
+    tf.compat.v1.keras.backend.set_session(tf_session)
+
+    # Load model to memory
+    # Change model input shape to accept all size inputs
+    model = keras.models.load_model(model_path_file_name, compile=False)
+    inputs = keras.Input((None, None, 3))
+    output = model(inputs)
+    return keras.models.Model(inputs, output)
+
+
+model_registry.register("fast_srgan", load_model, remote=True)
 
 
 def process_super_resolution_images(sr_image_objects, max_width, max_height):
+    import tensorflow as tf
+    from keras import backend as kb
+
+    model = model_registry.get("fast_srgan")
 
     # Loop over all images
     # Input and output image is full path + filename including extension
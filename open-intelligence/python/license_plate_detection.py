@@ -8,11 +8,11 @@ import numpy as np
 
 from libraries.openalpr_64.openalpr import Alpr
 import database
+import model_registry
+from config import APP_CONFIG as app_config
 from utils import load_image, save_image
 
 # Custom config
-app_config = database.get_application_config()
-
 output_root_folder_path = database.find_config_value(app_config, "output_folder")
 alpr_enabled = (
     database.find_config_value(app_config, "enabled") == "True"
@@ -39,100 +39,99 @@ class Plate:
         self.confidence = confidence
 
 
+def load_alpr():
+    # Set path for alpr
+    environ["PATH"] = alpr_dir + ";" + environ["PATH"]
+
+    alpr = Alpr(region, open_alpr_conf, open_alpr_runtime_data)
+    if not alpr.is_loaded():
+        print("Error loading OpenALPR")
+        return None
+    alpr.set_top_n(7)
+    alpr.set_default_region("md")
+    return alpr
+
+
+model_registry.register("alpr", load_alpr)
+
+
+def get_alpr():
+    """Load OpenALPR on first use and keep it loaded, once per process."""
+    return model_registry.get("alpr")
+
+
 def detect_license_plate(image_fqfn):
-    try:
+    return detect_license_plates([image_fqfn])[0]
+
 
-        if alpr_enabled and os.path.exists(image_fqfn):
-
-            result_plates = []  # From here we pick one with highest confidence
-            result_plate = None
-
-            # Set path for alpr
-            environ["PATH"] = alpr_dir + ";" + environ["PATH"]
-
-            all_images = [image_fqfn]
-            input_image = load_image(image_fqfn)
-            # Todo.. make settings about this below feature, this is making process very very slow
-            rotation_images = get_rotation_images(input_image, image_fqfn)
-            all_images = all_images + rotation_images  # append together
-
-            # Initialize openalpr
-            alpr = Alpr(region, open_alpr_conf, open_alpr_runtime_data)
-            if not alpr.is_loaded():
-                print("Error loading OpenALPR")
-                return ""
-            alpr.set_top_n(7)
-            alpr.set_default_region("md")
-
-            for image in all_images:
-
-                # Image file is loaded here
-                results = alpr.recognize_file(image)
-                # print("Run ALPR for: " + image)
-
-                i = 0
-                for plate in results["results"]:
-                    i += 1
-                    print("Plate #%d" % i)
-                    print("   %12s %12s" % ("Plate", "Confidence"))
-                    for candidate in plate["candidates"]:
-                        prefix = "-"
-                        if candidate["matches_template"]:
-                            prefix = "*"
-
-                        print(
-                            "  %s %12s%12f"
-                            % (prefix, candidate["plate"], candidate["confidence"])
-                        )
-                        license_plate = candidate["plate"]
-                        confidence = candidate["confidence"]
-
-                        if use_plate_char_length:
-                            if len(license_plate) == plate_char_length:
-                                # Take specified length one
-                                result_plates.append(
-                                    Plate(
-                                        region_filter(license_plate, region), confidence
-                                    )
-                                )
-                                break
-                        else:
-                            # Take first one (highest confidence)
-                            result_plates.append(
-                                Plate(region_filter(license_plate, region), confidence)
-                            )
-                            break
-
-                    # Call when completely done to release memory
-                    try:
-                        alpr.unload()
-                    except Exception as e:
-                        print(e)
-
-                # Delete temporary rotation images
-                if len(rotation_images) > 0:
-                    for ri in rotation_images:
-                        os.remove(ri)
-
-                # Sort array
-                result_plates.sort(key=lambda x: x.confidence, reverse=True)
-
-                # Take first if has one
-                if len(result_plates) > 0:
-                    result_plate = result_plates[0].plate
-
-                # Final result
-                # if result_plate is not None:
-                #     print('Result plate: ' + result_plate)
-                # else:
-                #     print('Did not recognize any license plate.')
-
-                return result_plate
+def detect_license_plates(image_fqfns):
+    """
+    Best plate per image, one OpenALPR instance serves the whole batch.
 
+    Returns:
+        list: Plate, None when no plate was read, or "" when ALPR is disabled or
+        the image is missing, per image.
+    """
+    results = [""] * len(image_fqfns)
+    if not alpr_enabled:
+        return results
+    try:
+        loaded_alpr = get_alpr()
+        if loaded_alpr is None:
+            return results
+        for i, image_fqfn in enumerate(image_fqfns):
+            if os.path.exists(image_fqfn):
+                results[i] = recognize_plate(loaded_alpr, image_fqfn)
     except AssertionError as e:
         print(e)
+    return results
+
 
-    return ""
+def recognize_plate(alpr, image_fqfn):
+    result_plates = []  # From here we pick one with highest confidence
+
+    # Only the image itself is read. Rotated copies from get_rotation_images were
+    # written and deleted again without being recognized, the Todo is about
+    # making them a setting as they make the process very very slow.
+    results = alpr.recognize_file(image_fqfn)
+
+    i = 0
+    for plate in results["results"]:
+        i += 1
+        print("Plate #%d" % i)
+        print("   %12s %12s" % ("Plate", "Confidence"))
+        for candidate in plate["candidates"]:
+            prefix = "-"
+            if candidate["matches_template"]:
+                prefix = "*"
+
+            print(
+                "  %s %12s%12f" % (prefix, candidate["plate"], candidate["confidence"])
+            )
+            license_plate = candidate["plate"]
+            confidence = candidate["confidence"]
+
+            if use_plate_char_length:
+                if len(license_plate) == plate_char_length:
+                    # Take specified length one
+                    result_plates.append(
+                        Plate(region_filter(license_plate, region), confidence)
+                    )
+                    break
+            else:
+                # Take first one (highest confidence)
+                result_plates.append(
+                    Plate(region_filter(license_plate, region), confidence)
+                )
+                break
+
+    # Sort array
+    result_plates.sort(key=lambda x: x.confidence, reverse=True)
+
+    # Take first if has one
+    if len(result_plates) > 0:
+        return result_plates[0].plate
+    return None
 
 
 # Rotate image to boost plate finding probability
@@ -0,0 +1,81 @@
+"""Lightweight in-process counters and stage timers for the processing services."""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StageStats:
+    """Throughput and busy time of one processing stage run by one or more threads."""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.count = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, frames=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.count += frames
+                self.busy_seconds += elapsed
+
+    def ms_per_frame(self):
+        return self.busy_seconds / self.count * 1000 if self.count else 0.0
+
+    def summary(self, wall_seconds):
+        if self.count == 0 or wall_seconds <= 0:
+            return f"{self.name}: idle"
+        return "{}: {} frames, {:.1f} frames/s, {:.1f} ms/frame, {:.0f}% busy".format(
+            self.name,
+            self.count,
+            self.count / wall_seconds,
+            self.ms_per_frame(),
+            self.busy_seconds / (wall_seconds * self.workers) * 100,
+        )
+
+
+class CascadeStats:
+    """Escalation rate and time saved by screening frames with a small model."""
+
+    def __init__(self):
+        self.frames = 0
+        self.escalated = Counter()
+        self.small_seconds = 0.0
+        self.large_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, frames, reasons, small_seconds, large_seconds):
+        """reasons holds one escalation reason per frame run by the large model."""
+        with self._lock:
+            self.frames += frames
+            self.escalated.update(reasons)
+            self.small_seconds += small_seconds
+            self.large_seconds += large_seconds
+
+    def summary(self):
+        escalated = sum(self.escalated.values())
+        if self.frames == 0:
+            return "cascade: idle"
+        line = "cascade: {} frames, {:.1f}% escalated ({})".format(
+            self.frames,
+            escalated / self.frames * 100,
+            ", ".join(f"{reason} {n}" for reason, n in self.escalated.items())
+            or "none",
+        )
+        if escalated:
+            # Large model time per frame stands in for what the skipped frames
+            # would have cost without the cascade
+            large_only = self.large_seconds / escalated * self.frames
+            saved = large_only - self.small_seconds - self.large_seconds
+            line += ", {:.1f} s saved ({:.0f}% of large model only)".format(
+                saved, saved / large_only * 100
+            )
+        return line
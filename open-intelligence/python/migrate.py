@@ -0,0 +1,130 @@
+"""Applies the SQL files in migrations/ the database has not seen yet.
+
+The API creates the tables with Sequelize, the migrations add what the python
+services need on top of them. Files run in name order, each in a transaction of
+its own, and are recorded in schema_migrations. Services apply the pending ones
+at start, an advisory lock keeps services starting together from running them
+twice. A migration that fails raises, the service exits and is restarted.
+
+Usage:
+    python migrate.py [--list]
+"""
+
+import argparse
+import os
+import time
+
+import psycopg2
+
+import database
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Any constant shared by the services, only one of them migrates at a time
+ADVISORY_LOCK_ID = 7162534
+
+# The API creates data on its first start, services started along with it wait
+DATA_TABLE_WAIT_SECONDS = 300
+DATA_TABLE_POLL_SECONDS = 5
+
+# noinspection SqlDialectInspection,SqlNoDataSourceInspection
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name VARCHAR(255) PRIMARY KEY,
+        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )"""
+
+
+def migration_files():
+    return sorted(f for f in os.listdir(MIGRATIONS_PATH) if f.endswith(".sql"))
+
+
+def applied_migrations(cursor):
+    cursor.execute(CREATE_MIGRATIONS_TABLE)
+    cursor.execute("SELECT name FROM schema_migrations")
+    return {name for (name,) in cursor.fetchall()}
+
+
+def wait_for_data_table():
+    """Wait until the database accepts connections and the data table exists."""
+    deadline = time.monotonic() + DATA_TABLE_WAIT_SECONDS
+    while True:
+        try:
+            connection = database.get_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute("SELECT to_regclass('data')")
+                (table,) = cursor.fetchone()
+                cursor.close()
+                connection.rollback()
+            finally:
+                database.release_connection(connection)
+            if table is not None:
+                return
+            reason = "table data does not exist yet"
+        except psycopg2.OperationalError as error:
+            reason = str(error).strip()
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"Database not ready for migrations: {reason}")
+        print(f"Waiting for the database, {reason}")
+        time.sleep(DATA_TABLE_POLL_SECONDS)
+
+
+def apply_migrations():
+    """
+    Apply the pending migrations, raises when one fails.
+
+    Returns:
+        list: Names of the migrations applied.
+    """
+    wait_for_data_table()
+    applied = []
+    connection = database.get_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+        try:
+            done = applied_migrations(cursor)
+            connection.commit()
+            for name in migration_files():
+                if name in done:
+                    continue
+                with open(os.path.join(MIGRATIONS_PATH, name)) as f:
+                    cursor.execute(f.read())
+                cursor.execute(
+                    "INSERT INTO schema_migrations (name) VALUES (%s)", (name,)
+                )
+                connection.commit()
+                applied.append(name)
+                print(f"Applied migration {name}")
+        finally:
+            connection.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+            connection.commit()
+        cursor.close()
+    except psycopg2.DatabaseError:
+        database.rollback(connection)
+        raise
+    finally:
+        database.release_connection(connection)
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument(
+        "--list", action="store_true", help="List the pending migrations and exit"
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        connection = database.get_connection()
+        try:
+            done = applied_migrations(connection.cursor())
+            connection.commit()
+        finally:
+            database.release_connection(connection)
+        for name in migration_files():
+            print(name, "applied" if name in done else "pending")
+    else:
+        apply_migrations()
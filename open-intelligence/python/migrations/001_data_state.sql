@@ -0,0 +1,120 @@
+-- Pipeline state of the data rows in a narrow table of its own.
+--
+-- The work queue queries of the python services poll the state flags, on the wide
+-- data table every poll scanned more rows as the table grew. The partial indexes
+-- below only hold the rows still pending for a stage, so a poll reads the pending
+-- rows and not the table.
+--
+-- The flags stay on data as well, the API reads and writes them there. Triggers on
+-- data keep data_state in step with every insert and update, whoever makes them.
+-- Rows deleted from data are deleted here by the foreign key.
+
+CREATE TABLE IF NOT EXISTS data_state (
+    data_id BIGINT PRIMARY KEY REFERENCES data (id) ON DELETE CASCADE,
+    label VARCHAR(255),
+    file_create_date TIMESTAMP WITH TIME ZONE,
+    detection_completed INTEGER NOT NULL DEFAULT 0,
+    sr_image_computed INTEGER NOT NULL DEFAULT 0,
+    detection_after_sr_completed INTEGER NOT NULL DEFAULT 0,
+    insight_face_computed INTEGER NOT NULL DEFAULT 0,
+    similarity_checked INTEGER NOT NULL DEFAULT 0,
+    deleted BOOLEAN NOT NULL DEFAULT false
+);
+
+
+CREATE OR REPLACE FUNCTION data_state_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO data_state (
+        data_id, label, file_create_date, detection_completed, sr_image_computed,
+        detection_after_sr_completed, insight_face_computed, similarity_checked,
+        deleted
+    )
+    SELECT
+        id, label, file_create_date, COALESCE(detection_completed, 0),
+        COALESCE(sr_image_computed, 0), COALESCE(detection_after_sr_completed, 0),
+        COALESCE(insight_face_computed, 0), COALESCE(similarity_checked, 0),
+        COALESCE(deleted, false)
+    FROM inserted_data;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION data_state_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE data_state s SET
+        label = u.label,
+        file_create_date = u.file_create_date,
+        detection_completed = COALESCE(u.detection_completed, 0),
+        sr_image_computed = COALESCE(u.sr_image_computed, 0),
+        detection_after_sr_completed = COALESCE(u.detection_after_sr_completed, 0),
+        insight_face_computed = COALESCE(u.insight_face_computed, 0),
+        similarity_checked = COALESCE(u.similarity_checked, 0),
+        deleted = COALESCE(u.deleted, false)
+    FROM updated_data u
+    WHERE
+        s.data_id = u.id
+        -- Updates of other columns leave the state row alone
+        AND (
+            s.label, s.file_create_date, s.detection_completed, s.sr_image_computed,
+            s.detection_after_sr_completed, s.insight_face_computed,
+            s.similarity_checked, s.deleted
+        ) IS DISTINCT FROM (
+            u.label, u.file_create_date, COALESCE(u.detection_completed, 0),
+            COALESCE(u.sr_image_computed, 0), COALESCE(u.detection_after_sr_completed, 0),
+            COALESCE(u.insight_face_computed, 0), COALESCE(u.similarity_checked, 0),
+            COALESCE(u.deleted, false)
+        );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Statement level, a batch insert of detection rows costs one trigger call
+DROP TRIGGER IF EXISTS data_state_insert ON data;
+CREATE TRIGGER data_state_insert
+    AFTER INSERT ON data
+    REFERENCING NEW TABLE AS inserted_data
+    FOR EACH STATEMENT EXECUTE PROCEDURE data_state_insert();
+
+DROP TRIGGER IF EXISTS data_state_update ON data;
+CREATE TRIGGER data_state_update
+    AFTER UPDATE ON data
+    REFERENCING NEW TABLE AS updated_data
+    FOR EACH STATEMENT EXECUTE PROCEDURE data_state_update();
+
+
+-- Rows already in data, the triggers hold off writes to data until this commits
+INSERT INTO data_state (
+    data_id, label, file_create_date, detection_completed, sr_image_computed,
+    detection_after_sr_completed, insight_face_computed, similarity_checked, deleted
+)
+SELECT
+    id, label, file_create_date, COALESCE(detection_completed, 0),
+    COALESCE(sr_image_computed, 0), COALESCE(detection_after_sr_completed, 0),
+    COALESCE(insight_face_computed, 0), COALESCE(similarity_checked, 0),
+    COALESCE(deleted, false)
+FROM data
+ON CONFLICT (data_id) DO NOTHING;
+
+
+-- Pending rows per work queue, see the queries in database.py
+CREATE INDEX IF NOT EXISTS data_state_detection_pending
+    ON data_state (data_id)
+    WHERE detection_completed = 0;
+
+CREATE INDEX IF NOT EXISTS data_state_super_resolution_pending
+    ON data_state (file_create_date)
+    WHERE sr_image_computed = 0 AND label IN ('car', 'truck', 'bus');
+
+CREATE INDEX IF NOT EXISTS data_state_insight_face_pending
+    ON data_state (data_id)
+    WHERE insight_face_computed = 0 AND label = 'person';
+
+CREATE INDEX IF NOT EXISTS data_state_similarity
+    ON data_state (label, file_create_date)
+    WHERE NOT deleted;
+
+CREATE INDEX IF NOT EXISTS data_state_retention_pending
+    ON data_state (file_create_date)
+    WHERE NOT deleted;
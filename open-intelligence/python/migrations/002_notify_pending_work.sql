@@ -0,0 +1,75 @@
+-- Notifies the services waiting for work, see database.wait_for_notification.
+--
+-- Inserts and updates of data_state, made by the triggers of 001_data_state.sql,
+-- send one notification per stage and statement when rows became pending for
+-- that stage. Updates marking rows as done send nothing. Notifications are
+-- delivered at commit, a batch insert of detection rows wakes each service once.
+
+CREATE OR REPLACE FUNCTION data_state_notify_insert() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM new_state) THEN
+        RETURN NULL;
+    END IF;
+    IF EXISTS (SELECT 1 FROM new_state WHERE detection_completed = 0) THEN
+        PERFORM pg_notify('data_detection', '');
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM new_state
+        WHERE sr_image_computed = 0 AND label IN ('car', 'truck', 'bus')
+    ) THEN
+        PERFORM pg_notify('data_super_resolution', '');
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM new_state
+        WHERE insight_face_computed = 0 AND label = 'person'
+    ) THEN
+        PERFORM pg_notify('data_insight_face', '');
+    END IF;
+    PERFORM pg_notify('data_similarity', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Only rows that were not pending before, as when the API asks for a row to be
+-- detected again
+CREATE OR REPLACE FUNCTION data_state_notify_update() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM new_state n JOIN old_state o USING (data_id)
+        WHERE n.detection_completed = 0 AND o.detection_completed <> 0
+    ) THEN
+        PERFORM pg_notify('data_detection', '');
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM new_state n JOIN old_state o USING (data_id)
+        WHERE
+            n.sr_image_computed = 0 AND n.label IN ('car', 'truck', 'bus')
+            AND NOT (o.sr_image_computed = 0 AND o.label IN ('car', 'truck', 'bus'))
+    ) THEN
+        PERFORM pg_notify('data_super_resolution', '');
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM new_state n JOIN old_state o USING (data_id)
+        WHERE
+            n.insight_face_computed = 0 AND n.label = 'person'
+            AND NOT (o.insight_face_computed = 0 AND o.label = 'person')
+    ) THEN
+        PERFORM pg_notify('data_insight_face', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS data_state_notify_insert ON data_state;
+CREATE TRIGGER data_state_notify_insert
+    AFTER INSERT ON data_state
+    REFERENCING NEW TABLE AS new_state
+    FOR EACH STATEMENT EXECUTE PROCEDURE data_state_notify_insert();
+
+DROP TRIGGER IF EXISTS data_state_notify_update ON data_state;
+CREATE TRIGGER data_state_notify_update
+    AFTER UPDATE ON data_state
+    REFERENCING OLD TABLE AS old_state NEW TABLE AS new_state
+    FOR EACH STATEMENT EXECUTE PROCEDURE data_state_notify_update();
@@ -0,0 +1,66 @@
+"""Models loaded on first use and shared by everything in the process.
+
+Modules only register how to load their models at import time, a model is loaded
+the first time it is asked for. Services then start without paying for models
+they never use, and a model used from several modules is still loaded once.
+
+Remote models are served by the inference server when it is running, get then
+returns an inference_client.RemoteModel in place of the local model.
+"""
+
+import threading
+import time
+
+import inference_client
+
+loaders = {}
+remote_models = set()
+models = {}
+load_locks = {}
+registry_lock = threading.Lock()
+
+
+def register(name, loader, remote=False):
+    """Register loader, called without arguments, as the way to load model name."""
+    with registry_lock:
+        loaders[name] = loader
+        if remote:
+            remote_models.add(name)
+        load_locks.setdefault(name, threading.Lock())
+
+
+def get(name):
+    """
+    Model name, loaded by its loader on the first call.
+
+    A loader returning None is called again on the next call, so a model that
+    failed to load can still come up later.
+    """
+    model = models.get(name)
+    if model is not None:
+        return model
+    if name not in loaders:
+        raise KeyError(f"No loader registered for model {name}")
+
+    with load_locks[name]:
+        if name not in models:
+            if name in remote_models and inference_client.server_available():
+                models[name] = inference_client.RemoteModel(name, loaders[name])
+                print(f"Using model {name} of the inference server")
+                return models[name]
+
+            start = time.perf_counter()
+            model = loaders[name]()
+            if model is None:
+                return None
+            models[name] = model
+            print(f"Loaded model {name} in {time.perf_counter() - start:.2f} s")
+        return models[name]
+
+
+def is_loaded(name):
+    return name in models
+
+
+def loaded_models():
+    return sorted(models)
@@ -0,0 +1,94 @@
+"""Frame difference prefilter that skips inference for frames without motion."""
+
+import threading
+from collections import Counter
+
+import cv2
+
+from config import (
+    CAMERA_NAMES_CONFIG,
+    MOTION_PIXEL_THRESHOLD,
+    MOTION_THRESHOLD,
+    MOTION_THRESHOLDS_CONFIG,
+)
+
+REFERENCE_WIDTH = 160
+REPORT_EVERY = 100
+
+# Camera name -> fraction of reference pixels that have to change
+CAMERA_MOTION_THRESHOLDS = {
+    name: float(threshold)
+    for name, threshold in zip(CAMERA_NAMES_CONFIG, MOTION_THRESHOLDS_CONFIG)
+    if threshold.strip()
+}
+
+# Camera name -> blurred grayscale thumbnail of its last frame with motion
+references = {}
+# Camera name -> Counter of frames and skipped frames
+motion_stats = {}
+lock = threading.Lock()
+
+
+def motion_thumbnail(fqfn):
+    # libjpeg decodes straight to 1/8 size grayscale, a fraction of a full decode
+    image = cv2.imread(fqfn, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        return None
+    height = max(1, round(image.shape[0] * REFERENCE_WIDTH / image.shape[1]))
+    thumbnail = cv2.resize(
+        image, (REFERENCE_WIDTH, height), interpolation=cv2.INTER_AREA
+    )
+    # Blur away sensor noise and JPEG artifacts
+    return cv2.GaussianBlur(thumbnail, (5, 5), 0)
+
+
+def motion_score(reference, thumbnail):
+    """Fraction of thumbnail pixels that changed by more than the pixel threshold."""
+    difference = cv2.absdiff(reference, thumbnail)
+    _, changed = cv2.threshold(
+        difference, MOTION_PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY
+    )
+    return cv2.countNonZero(changed) / changed.size
+
+
+def has_motion(camera, fqfn):
+    """
+    False when the frame hardly differs from the camera's reference frame.
+
+    The reference is the last frame with motion, not the previous frame, so slow
+    changes add up until they pass the threshold.
+    """
+    thumbnail = motion_thumbnail(fqfn)
+    if thumbnail is None:
+        # Leave unreadable frames to the detector
+        return True
+
+    threshold = CAMERA_MOTION_THRESHOLDS.get(camera, MOTION_THRESHOLD)
+    with lock:
+        reference = references.get(camera)
+        moved = (
+            reference is None
+            or reference.shape != thumbnail.shape
+            or motion_score(reference, thumbnail) >= threshold
+        )
+        if moved:
+            references[camera] = thumbnail
+
+        counts = motion_stats.setdefault(camera, Counter())
+        counts["frames"] += 1
+        counts["skipped"] += not moved
+        if counts["frames"] % REPORT_EVERY == 0:
+            print(motion_summary(camera))
+    return moved
+
+
+def motion_summary(camera):
+    counts = motion_stats.get(camera, Counter())
+    if not counts["frames"]:
+        return f"motion {camera}: idle"
+    return "motion {}: {} frames, {} skipped ({:.0f}%)".format(
+        camera,
+        counts["frames"],
+        counts["skipped"],
+        counts["skipped"] / counts["frames"] * 100,
+    )
@@ -1,62 +1,186 @@
+import math
 import os
+import sys
+import threading
+import time
 import traceback
+from collections import Counter
 from pathlib import Path
+from typing import NamedTuple
 
 import cv2
 import numpy as np
 import shutil
 
+import camera_roi
 import database
+import detection_cache
 import license_plate_detection
+import model_registry
+import motion_filter
+import yolo_backend
+from metrics import CascadeStats, StageStats
+from object_tracker import ObjectTracker
 from utils import File
 from config import (
     CONFIDENCE_THRESHOLD,
+    DB_WRITE_FLUSH_MS,
+    DB_WRITE_MAX_ROWS,
+    DETECTION_CACHE,
     INPUT_DIMENSIONS,
     YOLO_MODEL_PATH,
+    MOTION_FILTER,
     MOVED_TO_PROCESSED,
     NMS_THRESHOLD,
+    OBJECT_TRACKING,
     OBJECT_DETECTION_OUTPUT_PATH,
     OUTPUT_ROOT_PATH,
     SCORE_START_INDEX,
+    TRACKER_IOU_THRESHOLD,
+    TRACKER_MAX_AGE_SECONDS,
+    TRACKER_REANALYZE_IMPROVEMENT,
+    YOLO_BACKEND,
+    YOLO_CASCADE,
+    YOLO_CASCADE_ESCALATE_CONFIDENCE,
+    YOLO_CASCADE_MODEL,
+    YOLO_CASCADE_RECENT_SECONDS,
+    YOLO_GRAPH_OPTIMIZATION,
+    YOLO_INTER_OP_THREADS,
+    YOLO_INTRA_OP_THREADS,
     YOLO_KEEP_CLASSES,
     YOLO_KEEP_IDS,
+    YOLO_MODEL_PRECISION,
     YOLO_RESULT_OFFSET,
+    YOLO_TILE_OVERLAP,
+    YOLO_TILE_SIZE,
+    YOLO_TILED_CAMERAS,
     YOLO_VERSION,
 )
 from face_recognition import recognizeSF
-from utils import clip_negative_values, is_label_ignored, load_image, save_image
+from utils import (
+    clip_negative_values,
+    decode_reduced_image,
+    is_label_ignored,
+    load_image,
+    read_file_bytes,
+    save_image,
+)
 
+YOLO_KEEP_ID_ARRAY = np.array(sorted(YOLO_KEEP_IDS))
 
-def initialize_yolo_model():
-    if YOLO_VERSION == 8:
-        model_file = "yolov8l.onnx"
-    elif YOLO_VERSION == 9:
-        model_file = "yolov9m.onnx"
+
+def yolo_model_fqfn(precision=YOLO_MODEL_PRECISION, model_name=None):
+    """
+    ONNX file of the configured YOLO version, or of model_name when given.
+
+    Quantized variants made by quantize_yolo.py sit next to the FP32 model,
+    for example yolov8l.int8.onnx or yolov8l.fp16.onnx.
+    """
+    if model_name is None:
+        if YOLO_VERSION == 8:
+            model_name = "yolov8l"
+        elif YOLO_VERSION == 9:
+            model_name = "yolov9m"
+        else:
+            raise ValueError(f"Unsupported YOLO version: {YOLO_VERSION}")
+
+    if precision == "fp32":
+        model_file = f"{model_name}.onnx"
+    elif precision in ("int8", "fp16"):
+        model_file = f"{model_name}.{precision}.onnx"
     else:
-        raise ValueError(f"Unsupported YOLO version: {YOLO_VERSION}")
+        raise ValueError(f"Unsupported YOLO model precision: {precision}")
+    return os.path.join(YOLO_MODEL_PATH, model_file)
+
 
-    model = cv2.dnn.readNetFromONNX(os.path.join(YOLO_MODEL_PATH, model_file))
-    if model.empty():
-        raise RuntimeError("Failed to load YOLO model")
-    return model
+def initialize_yolo_model(model_fqfn=None):
+    return yolo_backend.create_backend(
+        YOLO_BACKEND,
+        model_fqfn or yolo_model_fqfn(),
+        intra_op_threads=YOLO_INTRA_OP_THREADS,
+        inter_op_threads=YOLO_INTER_OP_THREADS,
+        graph_optimization=YOLO_GRAPH_OPTIMIZATION,
+    )
 
 
-yolo_model = initialize_yolo_model()
+model_registry.register("yolo", initialize_yolo_model, remote=True)
+model_registry.register(
+    "yolo_cascade",
+    lambda: initialize_yolo_model(yolo_model_fqfn("fp32", YOLO_CASCADE_MODEL)),
+    remote=True,
+)
+
+
+def get_yolo_model():
+    """Load the YOLO net on first use, once per process."""
+    return model_registry.get("yolo")
+
+
+def get_small_yolo_model():
+    """Load the cascade screening model on first use, once per process."""
+    return model_registry.get("yolo_cascade")
 
 
 def detect_objects_in_image(model, image):
     blob = cv2.dnn.blobFromImage(
         image, 1 / 255, INPUT_DIMENSIONS, [0, 0, 0], 1, crop=False
     )
-    model.setInput(blob)
-    outputs = model.forward(model.getUnconnectedOutLayersNames())
+    outputs = model.forward(blob)
 
     if YOLO_VERSION == 8:
         outputs = (outputs[0].transpose((0, 2, 1)),)
     return outputs
 
 
-def process_yolo_output(input_image, yolo_outputs):
+# Frames run one by one after a refused batch before batching is tried again. An
+# ONNX file with a fixed batch size of one keeps refusing, a passing failure does
+# not turn batching off for good.
+BATCH_RETRY_FRAMES = 1000
+
+
+def detect_objects_in_images(model, images):
+    """
+    Run several frames through one forward pass.
+
+    Returns:
+        list: Outputs per frame, in the form detect_objects_in_image returns them.
+    """
+    unbatched_frames = getattr(model, "unbatched_frames", 0)
+    if len(images) == 1 or unbatched_frames > 0:
+        if unbatched_frames > 0:
+            model.unbatched_frames = max(0, unbatched_frames - len(images))
+        return [detect_objects_in_image(model, image) for image in images]
+
+    blob = cv2.dnn.blobFromImages(
+        images, 1 / 255, INPUT_DIMENSIONS, [0, 0, 0], 1, crop=False
+    )
+    try:
+        outputs = model.forward(blob)
+    except Exception as e:
+        print(
+            f"YOLO model refused a batch, running the next {BATCH_RETRY_FRAMES} "
+            f"frames one by one: {e}"
+        )
+        model.unbatched_frames = BATCH_RETRY_FRAMES
+        return [detect_objects_in_image(model, image) for image in images]
+
+    frame_outputs = []
+    for i in range(len(images)):
+        outputs_i = tuple(output[i : i + 1] for output in outputs)
+        if YOLO_VERSION == 8:
+            outputs_i = (outputs_i[0].transpose((0, 2, 1)),)
+        frame_outputs.append(outputs_i)
+    return frame_outputs
+
+
+def decode_yolo_output(input_image, yolo_outputs):
+    """
+    Rows of kept classes above the confidence threshold, before NMS.
+
+    Returns:
+        tuple: class ids, confidences, boxes in model input coordinates and boxes
+        in input_image coordinates.
+    """
     class_ids, confidences, boxes, original_boxes = [], [], [], []
     image_height, image_width = input_image.shape[:2]
     x_factor, y_factor = (
@@ -65,37 +189,104 @@ def process_yolo_output(input_image, yolo_outputs):
     )
 
     for output in yolo_outputs:
-        rows = output.shape[YOLO_RESULT_OFFSET]
-        for row in output[0] if YOLO_VERSION == 8 else output:
-            scores = row[SCORE_START_INDEX:]
-            class_id = np.argmax(scores)
-            confidence = scores[class_id]
+        rows = output[0] if YOLO_VERSION == 8 else output
+        scores = rows[:, SCORE_START_INDEX:]
+        row_class_ids = np.argmax(scores, axis=1)
+        row_confidences = np.take_along_axis(
+            scores, row_class_ids[:, np.newaxis], axis=1
+        )[:, 0]
+
+        # Work in the dtype per row scalar arithmetic gave: float64 with NumPy 1.x
+        # value based casting, float32 under NEP 50. Keeps results bit identical
+        # to scoring rows one at a time.
+        work_dtype = (rows.dtype.type(1) / 2).dtype
+        keep = np.isin(row_class_ids, YOLO_KEEP_ID_ARRAY) & ~(
+            row_confidences.astype(work_dtype) <= CONFIDENCE_THRESHOLD
+        )
 
-            if class_id not in YOLO_KEEP_IDS or confidence <= CONFIDENCE_THRESHOLD:
-                continue
+        kept_boxes = rows[keep, :4].astype(work_dtype)
+        confidences.extend(row_confidences[keep].astype(float).tolist())
+        class_ids.extend(row_class_ids[keep])
+        boxes.extend(scale_bounding_boxes(kept_boxes, 1.0, 1.0))
+        original_boxes.extend(scale_bounding_boxes(kept_boxes, x_factor, y_factor))
+    return class_ids, confidences, boxes, original_boxes
 
-            confidences.append(float(confidence))
-            class_ids.append(class_id)
-            boxes.append(scale_bounding_box(row[:4], 1.0, 1.0))
-            original_boxes.append(scale_bounding_box(row[:4], x_factor, y_factor))
 
+def process_yolo_output(input_image, yolo_outputs):
+    class_ids, confidences, boxes, original_boxes = decode_yolo_output(
+        input_image, yolo_outputs
+    )
     indices = cv2.dnn.NMSBoxes(boxes, confidences, CONFIDENCE_THRESHOLD, NMS_THRESHOLD)
     return class_ids, indices, boxes, original_boxes
 
 
+def detection_input_size(camera):
+    """
+    Smallest frame size that still fills the model input with frame pixels.
+
+    The camera's region of interest is cropped before inference so it has to be at
+    least model input sized on its own. Tiled cameras need full resolution.
+    """
+    if camera in YOLO_TILED_CAMERAS:
+        return sys.maxsize, sys.maxsize
+    x_fraction, y_fraction = camera_roi.roi_fraction(camera)
+    return (
+        math.ceil(INPUT_DIMENSIONS[0] / x_fraction),
+        math.ceil(INPUT_DIMENSIONS[1] / y_fraction),
+    )
+
+
 def load_and_preprocess_image(image_object):
+    """
+    Decode a frame for detection, at reduced JPEG DCT scale when large enough.
+
+    The file is read once, its contents are hashed for the detection cache.
+
+    Returns:
+        tuple: (detection image, (x scale, y scale) to full resolution, content
+        hash or None without the cache), ("", "", None) when the frame can't be
+        loaded.
+    """
     image_path = os.path.join(
         image_object.root_path, image_object.file_path, image_object.file_name
     )
-    # print(f"Loading: {image_object}")
-    # print(f"from path: {image_path}")
-    full_size_image = load_image(image_path)
-    if full_size_image is None:
-        return "", ""
-    else:
-        reduced_image = cv2.resize(full_size_image.copy(), None, fx=0.4, fy=0.4)
+    data = read_file_bytes(image_path)
+    if data is None:
+        return "", "", None
+    image, scale = decode_reduced_image(data, *detection_input_size(image_object.name))
+    if image is None:
+        print(f"No image found for {image_path}")
+        return "", "", None
+    frame_hash = detection_cache.content_hash(data) if DETECTION_CACHE else None
+    return image, scale, frame_hash
+
+
+def scale_detections(detections, scale):
+    """Scale the full size boxes of a reduced frame to full resolution."""
+    x_scale, y_scale = scale
+    class_ids, indices, boxes, original_boxes = detections
+    original_boxes = [
+        (
+            int(left * x_scale),
+            int(top * y_scale),
+            int(width * x_scale),
+            int(height * y_scale),
+        )
+        for left, top, width, height in original_boxes
+    ]
+    return class_ids, indices, boxes, original_boxes
+
+
+def has_saved_objects(class_ids, indices):
+    """True when any detection is of a label that is not ignored."""
+    return any(not is_label_ignored(class_label(class_ids[i])) for i in indices)
 
-    return full_size_image, reduced_image
+
+def class_label(class_id):
+    # Grazing animal classes are all reported as deer
+    if class_id in range(18, 25):
+        return "deer"
+    return YOLO_KEEP_CLASSES[class_id]
 
 
 def scale_bounding_box(box, x_factor, y_factor):
@@ -107,6 +298,41 @@ def scale_bounding_box(box, x_factor, y_factor):
     return (left, top, width, height)
 
 
+def scale_bounding_boxes(boxes, x_factor, y_factor):
+    """scale_bounding_box for an (n, 4) array of center based boxes."""
+    cx, cy, w, h = boxes.T
+    scaled = np.stack(
+        (
+            (cx - w / 2) * x_factor,
+            (cy - h / 2) * y_factor,
+            w * x_factor,
+            h * y_factor,
+        ),
+        axis=1,
+    )
+    # astype truncates toward zero like int()
+    return [tuple(box) for box in scaled.astype(np.int64).tolist()]
+
+
+# Fixed color per class id, the same label is drawn in the same color on every frame
+LABEL_COLORS = [
+    tuple(color) for color in np.random.default_rng(0).uniform(0, 255, (80, 3)).tolist()
+]
+
+# Per thread frame sized buffer the detection boxes are drawn on, reused between
+# frames of the same size
+overlay_buffers = threading.local()
+
+
+def overlay_image(image):
+    """Copy of image in this thread's reusable overlay buffer."""
+    buffer = getattr(overlay_buffers, "buffer", None)
+    if buffer is None or buffer.shape != image.shape or buffer.dtype != image.dtype:
+        buffer = overlay_buffers.buffer = np.empty_like(image)
+    np.copyto(buffer, image)
+    return buffer
+
+
 def extract_and_process_objects(
     image_object: File,
     image_fullsize,
@@ -117,41 +343,57 @@ def extract_and_process_objects(
 ) -> bool:
     output_filename = image_object.file_name_from_datetime()
     font = cv2.FONT_HERSHEY_PLAIN
-    colors = np.random.uniform(0, 255, size=(len(class_ids), 3))
-    clean_image = image_fullsize.copy()
+    drawn, detected_objects = [], []
     for i in indices:
-        x, y, w, h = clip_negative_values(boxes[i])
         x_, y_, w_, h_ = clip_negative_values(original_boxes[i])
-
-        cropped_image = clean_image[y_ : y_ + h_, x_ : x_ + w_].copy()
-        label = YOLO_KEEP_CLASSES[class_ids[i]]
-        color = colors[i]
-
-        if class_ids[i] in range(18, 25):
-            label = "deer"
-
-        cv2.rectangle(image_fullsize, (x_, y_), (x_ + w_, y_ + h_), color, 1)
-        cv2.putText(image_fullsize, label, (x_, y_ + 20), font, 2, color, 2)
+        label = class_label(class_ids[i])
+        drawn.append((label, class_ids[i], (x_, y_, w_, h_)))
 
         if not is_label_ignored(label):
-            process_detected_object(
-                image_object, label, cropped_image, output_filename, i
+            # The crop is a view of the frame, boxes are only drawn on the overlay
+            detected_objects.append(
+                save_detected_object(
+                    image_object,
+                    label,
+                    image_fullsize[y_ : y_ + h_, x_ : x_ + w_],
+                    output_filename,
+                    i,
+                    (x_, y_, w_, h_),
+                )
             )
 
-            if boxes:
-                save_image(
-                    os.path.join(OBJECT_DETECTION_OUTPUT_PATH, image_object.file_name),
-                    image_fullsize,
-                )
-                return True
-    return False
+    if not detected_objects or not boxes:
+        return False
+
+    overlay = overlay_image(image_fullsize)
+    for label, class_id, (x_, y_, w_, h_) in drawn:
+        color = LABEL_COLORS[class_id % len(LABEL_COLORS)]
+        cv2.rectangle(overlay, (x_, y_), (x_ + w_, y_ + h_), color, 1)
+        cv2.putText(overlay, label, (x_, y_ + 20), font, 2, color, 2)
+    save_image(
+        os.path.join(OBJECT_DETECTION_OUTPUT_PATH, image_object.file_name),
+        overlay,
+    )
+
+    process_detected_objects(image_object, detected_objects)
+    return True
 
     # if SHOW_PREVIEW:
     #     cv2.imshow("Image", image_fullsize)
     #     cv2.waitKey(1)
 
 
-def process_detected_object(image_object, label, cropped_image, output_filename, index):
+class DetectedObject(NamedTuple):
+    label: str
+    crop_fn: str
+    crop_fqfn: str
+    output_fn: str
+    box: tuple
+
+
+def save_detected_object(
+    image_object, label, cropped_image, output_filename, index, box
+) -> DetectedObject:
 
     crop_fn = f"{output_filename}_{index}_{image_object.file_extension}"
     crop_path = os.path.join(OUTPUT_ROOT_PATH, label)
@@ -160,39 +402,170 @@ def process_detected_object(image_object, label, cropped_image, output_filename,
     Path(crop_path).mkdir(parents=True, exist_ok=True)
     save_image(crop_fqfn, cropped_image)
 
-    color, detection_result = "", ""
-    if label in ["car", "truck", "bus", "motorcycle", "person"]:
-        detection_result = add_car_and_people_insights(
-            label=label,
-            image_fqfn=crop_fqfn,
-            output_fn=f"{label}_{output_filename}_{index}_{image_object.file_extension}",
-        )
-
-    database.insert_value(
-        image_object.name,
+    return DetectedObject(
         label,
-        image_object.file_path,
-        image_object.file_name,
-        image_object.file_create_date(),
         crop_fn,
-        detection_result,
-        color,
+        crop_fqfn,
+        f"{label}_{output_filename}_{index}_{image_object.file_extension}",
+        box,
     )
 
 
+# Rows of all frames are inserted in batches by a background thread
+data_writer = database.BufferedInserter(
+    database.DATA_INSERT_QUERY, DB_WRITE_MAX_ROWS, DB_WRITE_FLUSH_MS
+)
+
+
+def process_detected_objects(image_object, detected_objects):
+    """Run the analyzers on all crops of a frame and queue their rows for insert."""
+    color = ""
+    detection_results = analyze_detected_objects(image_object, detected_objects)
+    rows = [
+        (
+            image_object.name,
+            detected_object.label,
+            image_object.file_path,
+            image_object.file_name,
+            image_object.file_create_date(),
+            detected_object.crop_fn,
+            detection_result,
+            color,
+        )
+        for detected_object, detection_result in zip(
+            detected_objects, detection_results
+        )
+    ]
+    data_writer.add([database.data_record(row) for row in rows])
+
+
+# Face and plate models are shared module globals and not thread safe, the
+# pipeline write stage runs several writers
+insights_lock = threading.Lock()
+
+VEHICLE_LABELS = ["car", "truck", "bus", "motorcycle"]
+INSIGHT_LABELS = VEHICLE_LABELS + ["person"]
+
+
 def add_car_and_people_insights(label, image_fqfn, output_fn, use_rotation=False):
     return_value = None
     try:
-        if label in ["car", "truck", "bus", "motorcycle"]:
-            return_value = license_plate_detection.detect_license_plate(image_fqfn)
-        elif label == "person":
-            return_value = recognizeSF.recognize(image_fqfn, output_fn)
+        with insights_lock:
+            if label in VEHICLE_LABELS:
+                return_value = license_plate_detection.detect_license_plate(image_fqfn)
+            elif label == "person":
+                return_value = recognizeSF.recognize(image_fqfn, output_fn)
     except Exception as e:
         print(f"Error in object detection: {e}")
         print(traceback.format_exc())
     return return_value
 
 
+def add_car_and_people_insights_batch(detected_objects):
+    """
+    add_car_and_people_insights for all objects of a frame, plates of all vehicles
+    are read in one batch.
+
+    Returns:
+        list: Detection result per object, "" for labels without an analyzer.
+    """
+    results = [None if obj.label in INSIGHT_LABELS else "" for obj in detected_objects]
+    vehicles = [
+        i for i, obj in enumerate(detected_objects) if obj.label in VEHICLE_LABELS
+    ]
+    people = [i for i, obj in enumerate(detected_objects) if obj.label == "person"]
+
+    with insights_lock:
+        if vehicles:
+            try:
+                plates = license_plate_detection.detect_license_plates(
+                    [detected_objects[i].crop_fqfn for i in vehicles]
+                )
+                for i, plate in zip(vehicles, plates):
+                    results[i] = plate
+            except Exception as e:
+                print(f"Error in object detection: {e}")
+                print(traceback.format_exc())
+
+        for i in people:
+            try:
+                results[i] = recognizeSF.recognize(
+                    detected_objects[i].crop_fqfn, detected_objects[i].output_fn
+                )
+            except Exception as e:
+                print(f"Error in object detection: {e}")
+                print(traceback.format_exc())
+    return results
+
+
+"""Tracking: analyzers run once per tracked object, on its best frame so far."""
+
+# Camera name -> ObjectTracker
+trackers = {}
+trackers_lock = threading.Lock()
+tracking_stats = Counter()
+TRACKING_REPORT_EVERY = 100
+
+
+def get_tracker(camera):
+    with trackers_lock:
+        if camera not in trackers:
+            trackers[camera] = ObjectTracker(
+                TRACKER_IOU_THRESHOLD, TRACKER_MAX_AGE_SECONDS
+            )
+        return trackers[camera]
+
+
+def crop_quality(box):
+    """Larger crops show plates and faces with more pixels."""
+    _, _, width, height = box
+    return float(width * height)
+
+
+def analyze_detected_objects(image_object, detected_objects):
+    """
+    Detection result per object of a frame.
+
+    With tracking an object is analyzed on the first frame of its track and on
+    frames with a clearly larger crop, other frames reuse the track's result.
+    """
+    if not OBJECT_TRACKING:
+        return add_car_and_people_insights_batch(detected_objects)
+
+    tracks = get_tracker(image_object.name).update(
+        [obj.label for obj in detected_objects],
+        [obj.box for obj in detected_objects],
+        image_object.time_stamp,
+    )
+    qualities = [crop_quality(obj.box) for obj in detected_objects]
+    analyzed = [
+        i
+        for i, (track, quality) in enumerate(zip(tracks, qualities))
+        if track.needs_analysis(quality, TRACKER_REANALYZE_IMPROVEMENT)
+    ]
+    results = add_car_and_people_insights_batch([detected_objects[i] for i in analyzed])
+    for i, result in zip(analyzed, results):
+        tracks[i].set_result(result, qualities[i])
+
+    with trackers_lock:
+        reported = tracking_stats["objects"] // TRACKING_REPORT_EVERY
+        tracking_stats["objects"] += sum(
+            obj.label in INSIGHT_LABELS for obj in detected_objects
+        )
+        tracking_stats["analyzed"] += sum(
+            detected_objects[i].label in INSIGHT_LABELS for i in analyzed
+        )
+        if tracking_stats["objects"] // TRACKING_REPORT_EVERY > reported:
+            print(
+                "tracking: {} objects, {} analyzed, {:.0f}% reused".format(
+                    tracking_stats["objects"],
+                    tracking_stats["analyzed"],
+                    100 - tracking_stats["analyzed"] / tracking_stats["objects"] * 100,
+                )
+            )
+    return [track.result for track in tracks]
+
+
 """Move the image file to the processed folder."""
 
 
@@ -213,35 +586,399 @@ def move_to_processed(image_record):
         os.remove(fqfn)
 
 
-def analyze_image(image_object):
+"""Inference stage: YOLO forward and output decoding for a loaded frame."""
+
+
+def infer_image(full_size_image, camera=None, frame_hash=None):
+    return infer_images([full_size_image], [camera], [frame_hash])[0]
+
+
+def infer_images(full_size_images, cameras=None, frame_hashes=None):
+    """
+    Detections per frame, in the form process_yolo_output returns them.
+
+    cameras names the camera of each frame. Frames are cropped to the camera's
+    region of interest before inference and boxes are mapped back to full frame
+    coordinates. The cascade also uses it to keep running the large model on
+    cameras with recent detections.
+
+    Frames with a content hash in frame_hashes are looked up in the detection
+    cache first, only the misses are run through the net. Only detections of the
+    large model are cached, a frame the cascade cleared is screened again.
+    """
+    cameras = cameras or [None] * len(full_size_images)
+    frame_hashes = frame_hashes or [None] * len(full_size_images)
+    if not DETECTION_CACHE:
+        detections, _ = detect_images(full_size_images, cameras)
+        return detections
+
+    keys = [
+        frame_hash and detection_cache_key(frame_hash, image, camera)
+        for frame_hash, image, camera in zip(frame_hashes, full_size_images, cameras)
+    ]
+    results = [key and detection_cache.get(key) for key in keys]
+    for result, camera in zip(results, cameras):
+        # Keeps the cascade escalating for a camera whose frames are cache hits
+        if result is not None and len(result[1]) and camera is not None:
+            last_detection_times[camera] = time.monotonic()
+    missed = [i for i, result in enumerate(results) if result is None]
+    if missed:
+        detections, large_model_ran = detect_images(
+            [full_size_images[i] for i in missed], [cameras[i] for i in missed]
+        )
+        for i, frame_detections, cacheable in zip(missed, detections, large_model_ran):
+            results[i] = frame_detections
+            if keys[i] and cacheable:
+                detection_cache.put(keys[i], frame_detections)
+    return results
+
+
+def detection_cache_key(frame_hash, image, camera):
+    """Cache key of a frame, covering the settings its detections depend on."""
+    return detection_cache.cache_key(
+        frame_hash,
+        image.shape,
+        yolo_model_fqfn(),
+        camera_roi.CAMERA_ROIS.get(camera, np.empty(0)).tolist(),
+        camera in YOLO_TILED_CAMERAS and (YOLO_TILE_SIZE, YOLO_TILE_OVERLAP),
+    )
 
-    try:
 
-        full_size_image, _ = load_and_preprocess_image(image_object)
+def detect_images(full_size_images, cameras):
+    """
+    Returns:
+        tuple: (detections per frame, whether the large model ran on each frame)
+    """
+    crops, offsets = [], []
+    for image, camera in zip(full_size_images, cameras):
+        crop, offset = camera_roi.crop_to_roi(image, camera)
+        crops.append(crop)
+        offsets.append(offset)
+
+    if YOLO_CASCADE:
+        detections, large_model_ran = cascade_infer_images(crops, cameras)
+    else:
+        detections = large_model_detections(crops, cameras)
+        large_model_ran = [True] * len(crops)
+    detections = [
+        camera_roi.offset_detections(frame_detections, offset)
+        for frame_detections, offset in zip(detections, offsets)
+    ]
+    return detections, large_model_ran
+
+
+def large_model_detections(full_size_images, cameras):
+    """Run the large model, frames of tiled cameras tile by tile."""
+    model = get_yolo_model()
+    results = [None] * len(full_size_images)
+
+    untiled = [
+        i for i, camera in enumerate(cameras) if camera not in YOLO_TILED_CAMERAS
+    ]
+    if untiled:
+        with untiled_stats.measure(len(untiled)):
+            yolo_outputs = detect_objects_in_images(
+                model, [full_size_images[i] for i in untiled]
+            )
+            for i, outputs in zip(untiled, yolo_outputs):
+                results[i] = process_yolo_output(full_size_images[i], outputs)
+
+    for i, camera in enumerate(cameras):
+        if camera in YOLO_TILED_CAMERAS:
+            stats = tiled_stats.setdefault(camera, StageStats(f"tiled {camera}"))
+            with stats.measure():
+                results[i] = tiled_infer_image(model, full_size_images[i])
+            if stats.count % TILED_REPORT_EVERY == 0:
+                print(tiled_latency_summary(stats))
+    return results
+
+
+"""Tiled inference: overlapping tiles of high resolution frames keep far objects large."""
+
+untiled_stats = StageStats("untiled")
+# Camera name -> StageStats of its tiled frames
+tiled_stats = {}
+TILED_REPORT_EVERY = 100
+# Boxes of one class lying this much inside another, by intersection over the
+# smaller area, are one object cut by a tile edge
+TILE_MERGE_THRESHOLD = 0.5
+
+
+def tile_origins(length, tile_size, overlap):
+    """Tile start offsets along one axis, the last tile ends at the frame edge."""
+    if length <= tile_size:
+        return [0]
+    step = max(1, int(tile_size * (1 - overlap)))
+    return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+
+def image_tiles(image):
+    """
+    The whole frame, for objects larger than a tile, followed by its overlapping tiles.
+
+    Returns:
+        list: (tile view, (x, y) origin of the tile in the frame) tuples.
+    """
+    tiles = [(image, (0, 0))]
+    height, width = image.shape[:2]
+    if height <= YOLO_TILE_SIZE and width <= YOLO_TILE_SIZE:
+        return tiles
+    for y in tile_origins(height, YOLO_TILE_SIZE, YOLO_TILE_OVERLAP):
+        for x in tile_origins(width, YOLO_TILE_SIZE, YOLO_TILE_OVERLAP):
+            tiles.append(
+                (image[y : y + YOLO_TILE_SIZE, x : x + YOLO_TILE_SIZE], (x, y))
+            )
+    return tiles
+
+
+def intersection_over_smaller(box, other):
+    left, top, width, height = box
+    other_left, other_top, other_width, other_height = other
+    overlap_width = min(left + width, other_left + other_width) - max(left, other_left)
+    overlap_height = min(top + height, other_top + other_height) - max(top, other_top)
+    if overlap_width <= 0 or overlap_height <= 0:
+        return 0.0
+    smaller = min(width * height, other_width * other_height)
+    return overlap_width * overlap_height / smaller if smaller > 0 else 0.0
+
+
+def merge_tile_boxes(class_ids, confidences, boxes, tile_ids):
+    """
+    Greedy merge of the boxes of one object cut apart by tile edges, class by class.
+
+    A tile cutting through an object only sees part of it. The partial box has too
+    little IoU with the full box of the neighbouring tile or of the whole frame for
+    NMS, but lies mostly inside it, so boxes are matched by intersection over the
+    smaller area. Only boxes of different tiles are merged, the boxes of one tile
+    already went through NMS. The kept box grows to the union of the boxes merged
+    into it.
+
+    Returns:
+        tuple: (indices of the kept boxes, boxes with the kept ones grown)
+    """
+    boxes = list(boxes)
+    order = sorted(range(len(boxes)), key=lambda i: confidences[i], reverse=True)
+    merged = set()
+    kept = []
+    for n, i in enumerate(order):
+        if i in merged:
+            continue
+        kept.append(i)
+        for j in order[n + 1 :]:
+            if (
+                j in merged
+                or tile_ids[j] == tile_ids[i]
+                or class_ids[j] != class_ids[i]
+                or intersection_over_smaller(boxes[i], boxes[j]) < TILE_MERGE_THRESHOLD
+            ):
+                continue
+            merged.add(j)
+            left, top, width, height = boxes[i]
+            other_left, other_top, other_width, other_height = boxes[j]
+            right = max(left + width, other_left + other_width)
+            bottom = max(top + height, other_top + other_height)
+            left, top = min(left, other_left), min(top, other_top)
+            boxes[i] = (left, top, right - left, bottom - top)
+    return kept, boxes
+
+
+def tiled_infer_image(model, full_size_image):
+    """
+    Detect objects tile by tile in one batch and merge the boxes of the tiles.
+
+    Each tile goes through NMS like an untiled frame, its survivors are then merged
+    with those of the other tiles. Boxes are returned in frame coordinates twice, in
+    place of the model input and full size boxes, as each tile is scaled to the
+    model input differently.
+    """
+    tiles = image_tiles(full_size_image)
+    tile_outputs = detect_objects_in_images(model, [tile for tile, _ in tiles])
+
+    class_ids, confidences, boxes, tile_ids = [], [], [], []
+    for tile_id, ((tile, (x, y)), outputs) in enumerate(zip(tiles, tile_outputs)):
+        (
+            tile_class_ids,
+            tile_confidences,
+            tile_input_boxes,
+            tile_boxes,
+        ) = decode_yolo_output(tile, outputs)
+        tile_indices = cv2.dnn.NMSBoxes(
+            tile_input_boxes, tile_confidences, CONFIDENCE_THRESHOLD, NMS_THRESHOLD
+        )
+        for i in np.array(tile_indices, dtype=int).flatten():
+            left, top, width, height = tile_boxes[i]
+            class_ids.append(tile_class_ids[i])
+            confidences.append(tile_confidences[i])
+            boxes.append((left + x, top + y, width, height))
+            tile_ids.append(tile_id)
+
+    indices, boxes = merge_tile_boxes(class_ids, confidences, boxes, tile_ids)
+    return class_ids, indices, boxes, boxes
+
 
-        yolo_outputs = detect_objects_in_image(yolo_model, full_size_image)
+def tiled_latency_summary(stats):
+    line = f"{stats.name}: {stats.count} frames, {stats.ms_per_frame():.0f} ms/frame"
+    if untiled_stats.count:
+        untiled = untiled_stats.ms_per_frame()
+        line += f", {stats.ms_per_frame() / untiled:.1f}x the {untiled:.0f} ms/frame of untiled frames"
+    return line
 
-        class_ids, indices, boxes, original_boxes = process_yolo_output(
-            full_size_image, yolo_outputs
+
+"""Detection cascade: a small model screens frames before the large model runs."""
+
+cascade_stats = CascadeStats()
+CASCADE_REPORT_EVERY = 100
+
+# Camera name -> time.monotonic() of its last frame with detections
+last_detection_times = {}
+
+
+def max_kept_confidence(yolo_outputs):
+    """Highest score any kept class gets in any row of the model outputs."""
+    best = 0.0
+    for output in yolo_outputs:
+        rows = output[0] if YOLO_VERSION == 8 else output
+        scores = rows[:, SCORE_START_INDEX + YOLO_KEEP_ID_ARRAY]
+        if scores.size:
+            best = max(best, float(scores.max()))
+    return best
+
+
+def escalation_reason(small_outputs, camera, now):
+    if max_kept_confidence(small_outputs) >= YOLO_CASCADE_ESCALATE_CONFIDENCE:
+        return "confidence"
+    last_detection = last_detection_times.get(camera)
+    if (
+        last_detection is not None
+        and now - last_detection < YOLO_CASCADE_RECENT_SECONDS
+    ):
+        return "recent"
+    return None
+
+
+def cascade_infer_images(full_size_images, cameras):
+    """
+    Returns:
+        tuple: (detections per frame, whether the frame was escalated to the large
+        model)
+    """
+    start = time.perf_counter()
+    small_outputs = detect_objects_in_images(get_small_yolo_model(), full_size_images)
+    now = time.monotonic()
+    reasons = [
+        escalation_reason(outputs, camera, now)
+        for outputs, camera in zip(small_outputs, cameras)
+    ]
+    small_seconds = time.perf_counter() - start
+
+    # Frames the small model clears are reported as having no detections
+    results = [([], [], [], []) for _ in full_size_images]
+    escalated = [i for i, reason in enumerate(reasons) if reason]
+    start = time.perf_counter()
+    if escalated:
+        large_results = large_model_detections(
+            [full_size_images[i] for i in escalated], [cameras[i] for i in escalated]
         )
+        for i, frame_results in zip(escalated, large_results):
+            results[i] = frame_results
+            if len(results[i][1]) and cameras[i] is not None:
+                last_detection_times[cameras[i]] = time.monotonic()
+    large_seconds = time.perf_counter() - start
+
+    reported = cascade_stats.frames // CASCADE_REPORT_EVERY
+    cascade_stats.record(
+        len(full_size_images),
+        [reason for reason in reasons if reason],
+        small_seconds,
+        large_seconds,
+    )
+    if cascade_stats.frames // CASCADE_REPORT_EVERY > reported:
+        print(cascade_stats.summary())
+    return results, [bool(reason) for reason in reasons]
 
-        if (
-            extract_and_process_objects(
-                image_object,
-                full_size_image,
-                class_ids,
-                indices,
-                boxes,
-                original_boxes,
-            )
-            and MOVED_TO_PROCESSED
-        ):
-            move_to_processed(image_object)
+
+"""Write stage: crops, insights, database rows and moving or removing the source frame."""
+
+
+def write_results(image_object, image, detections, scale=(1.0, 1.0)):
+    """
+    image is the frame detections were made on, reduced by scale. The full
+    resolution frame is only decoded when there are objects to crop and save.
+    """
+    full_size_image = image
+    if scale != (1.0, 1.0) and has_saved_objects(detections[0], detections[1]):
+        fqfn = os.path.join(
+            image_object.root_path, image_object.file_path, image_object.file_name
+        )
+        full_size_image = load_image(fqfn)
+        if full_size_image is None:
+            # Keep what was found, at the reduced resolution
+            full_size_image = image
         else:
-            fqfn = os.path.join(
-                image_object.root_path, image_object.file_path, image_object.file_name
+            detections = scale_detections(
+                detections,
+                (
+                    full_size_image.shape[1] / image.shape[1],
+                    full_size_image.shape[0] / image.shape[0],
+                ),
             )
-            os.remove(fqfn)
+
+    class_ids, indices, boxes, original_boxes = detections
+    if (
+        extract_and_process_objects(
+            image_object,
+            full_size_image,
+            class_ids,
+            indices,
+            boxes,
+            original_boxes,
+        )
+        and MOVED_TO_PROCESSED
+    ):
+        move_to_processed(image_object)
+    else:
+        remove_frame(image_object)
+
+
+def remove_frame(image_object):
+    """Delete a frame without anything to keep."""
+    fqfn = os.path.join(
+        image_object.root_path, image_object.file_path, image_object.file_name
+    )
+    os.remove(fqfn)
+
+
+def skip_without_motion(image_object):
+    """
+    Remove frames the motion prefilter finds unchanged, as frames without
+    detections are.
+
+    Returns:
+        bool: True when the frame was skipped.
+    """
+    if not MOTION_FILTER:
+        return False
+    fqfn = os.path.join(
+        image_object.root_path, image_object.file_path, image_object.file_name
+    )
+    if motion_filter.has_motion(image_object.name, fqfn):
+        return False
+    remove_frame(image_object)
+    return True
+
+
+def analyze_image(image_object):
+
+    try:
+
+        if skip_without_motion(image_object):
+            return
+
+        image, scale, frame_hash = load_and_preprocess_image(image_object)
+
+        detections = infer_image(image, image_object.name, frame_hash)
+
+        write_results(image_object, image, detections, scale)
 
     except EOFError as e:
         raise e
@@ -0,0 +1,149 @@
+"""SORT style multi object tracking of detections across the frames of a camera.
+
+Every track runs a constant velocity Kalman filter over its box center, area and
+aspect ratio. Each frame the tracks are predicted forward and matched to the new
+detections of the same label by IoU with the Hungarian algorithm, unmatched
+detections start new tracks.
+"""
+
+import itertools
+import threading
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# Constant velocity model over (cx, cy, area, aspect, vx, vy, varea)
+TRANSITION = np.eye(7)
+TRANSITION[0, 4] = TRANSITION[1, 5] = TRANSITION[2, 6] = 1
+MEASUREMENT = np.eye(4, 7)
+MEASUREMENT_NOISE = np.diag([1.0, 1.0, 10.0, 10.0])
+PROCESS_NOISE = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+INITIAL_COVARIANCE = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+track_ids = itertools.count(1)
+
+
+def box_to_measurement(box):
+    x, y, w, h = box
+    return np.array([x + w / 2, y + h / 2, w * h, w / max(h, 1)], dtype=np.float64)
+
+
+def state_to_box(state):
+    cx, cy, area, aspect = state[:4]
+    w = np.sqrt(max(area * aspect, 0.0))
+    h = area / w if w > 0 else 0.0
+    return cx - w / 2, cy - h / 2, w, h
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU of every (x, y, w, h) box in boxes_a with every box in boxes_b."""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    left = np.maximum(a[:, None, 0], b[None, :, 0])
+    top = np.maximum(a[:, None, 1], b[None, :, 1])
+    right = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    bottom = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - intersection
+    return np.divide(
+        intersection, union, out=np.zeros_like(intersection), where=union > 0
+    )
+
+
+class Track:
+    """One tracked object and the analyzer result of its best frame so far."""
+
+    def __init__(self, label, box, time_stamp):
+        self.id = next(track_ids)
+        self.label = label
+        self.state = np.zeros(7)
+        self.state[:4] = box_to_measurement(box)
+        self.covariance = INITIAL_COVARIANCE.copy()
+        self.last_seen = time_stamp
+        self.hits = 1
+
+        self.analyzed = False
+        self.best_quality = 0.0
+        self.result = None
+
+    def predict(self):
+        # Keep the predicted area from going negative
+        if self.state[2] + self.state[6] <= 0:
+            self.state[6] = 0.0
+        self.state = TRANSITION @ self.state
+        self.covariance = TRANSITION @ self.covariance @ TRANSITION.T + PROCESS_NOISE
+        return state_to_box(self.state)
+
+    def update(self, box, time_stamp):
+        residual = box_to_measurement(box) - MEASUREMENT @ self.state
+        innovation = MEASUREMENT @ self.covariance @ MEASUREMENT.T + MEASUREMENT_NOISE
+        gain = self.covariance @ MEASUREMENT.T @ np.linalg.inv(innovation)
+        self.state = self.state + gain @ residual
+        self.covariance = (np.eye(7) - gain @ MEASUREMENT) @ self.covariance
+        self.last_seen = time_stamp
+        self.hits += 1
+
+    def needs_analysis(self, quality, improvement):
+        """
+        True for the first frame of a track and for frames clearly better than the
+        one the current result came from.
+        """
+        return not self.analyzed or quality > self.best_quality * improvement
+
+    def set_result(self, result, quality):
+        # A better frame that gives no result does not replace an earlier result
+        if result or not self.analyzed:
+            self.result = result
+        self.analyzed = True
+        self.best_quality = max(self.best_quality, quality)
+
+
+class ObjectTracker:
+    """Tracks of one camera, frames are expected roughly in time order."""
+
+    def __init__(self, iou_threshold=0.3, max_age_seconds=10.0):
+        self.iou_threshold = iou_threshold
+        self.max_age_seconds = max_age_seconds
+        self.tracks = []
+        self._lock = threading.Lock()
+
+    def update(self, labels, boxes, time_stamp):
+        """
+        Match the detections of a frame to the tracks.
+
+        Args:
+            labels: Label per detection.
+            boxes: (x, y, w, h) box per detection, in frame coordinates.
+            time_stamp: datetime of the frame.
+
+        Returns:
+            list: Track per detection.
+        """
+        with self._lock:
+            self.tracks = [
+                track
+                for track in self.tracks
+                if (time_stamp - track.last_seen).total_seconds()
+                <= self.max_age_seconds
+            ]
+            predicted = [track.predict() for track in self.tracks]
+
+            matched = [None] * len(boxes)
+            if self.tracks and boxes:
+                iou = iou_matrix(boxes, predicted)
+                same_label = (
+                    np.array(labels)[:, None]
+                    == np.array([track.label for track in self.tracks])[None, :]
+                )
+                iou[~same_label] = 0.0
+                for detection, track in zip(*linear_sum_assignment(-iou)):
+                    if iou[detection, track] >= self.iou_threshold:
+                        self.tracks[track].update(boxes[detection], time_stamp)
+                        matched[detection] = self.tracks[track]
+
+            for detection, track in enumerate(matched):
+                if track is None:
+                    track = Track(labels[detection], boxes[detection], time_stamp)
+                    self.tracks.append(track)
+                    matched[detection] = track
+            return matched
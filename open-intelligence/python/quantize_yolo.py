@@ -0,0 +1,237 @@
+"""Make quantized variants of the YOLO ONNX model and compare them against FP32.
+
+INT8 models are statically quantized with onnxruntime, calibrated on a sample of
+our own camera frames. FP16 models keep FP32 inputs and outputs and store the
+weights as float16. The report compares detections per class and per frame
+latency of the quantized model against the FP32 one on frames not used for
+calibration.
+
+Usage:
+    python quantize_yolo.py --precision int8 --samples 300
+    python quantize_yolo.py --precision int8 --report-only
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+from collections import Counter
+
+import cv2
+
+import yolo_backend
+from config import (
+    CAMERA_FOLDERS_CONFIG,
+    CAMERAS_ROOT_PATH,
+    CONFIDENCE_THRESHOLD,
+    INPUT_DIMENSIONS,
+)
+from object_detection import (
+    class_label,
+    detect_objects_in_image,
+    process_yolo_output,
+    yolo_model_fqfn,
+)
+from utils import load_image, scan_images
+
+REPORT_LABELS = ["person", "car", "truck", "deer"]
+
+
+def sample_frames(folders, samples, seed=0):
+    """Random sample of frames from the given folders."""
+    frames = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        frames.extend(
+            os.path.join(folder, entry.file_name)
+            for entry in scan_images(folder)
+            if entry.file_name.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+    random.Random(seed).shuffle(frames)
+    return frames[:samples]
+
+
+def preprocess(image):
+    return cv2.dnn.blobFromImage(
+        image, 1 / 255, INPUT_DIMENSIONS, [0, 0, 0], 1, crop=False
+    )
+
+
+class FrameCalibrationReader:
+    """Feeds preprocessed camera frames to the onnxruntime calibrator."""
+
+    def __init__(self, input_name, frames):
+        self.input_name = input_name
+        self.frames = iter(frames)
+
+    def get_next(self):
+        for frame in self.frames:
+            image = load_image(frame)
+            if image is not None:
+                return {self.input_name: preprocess(image)}
+        return None
+
+
+def quantize_int8(model_fqfn, output_fqfn, calibration_frames):
+    import onnxruntime
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class Reader(FrameCalibrationReader, CalibrationDataReader):
+        pass
+
+    input_name = (
+        onnxruntime.InferenceSession(model_fqfn, providers=["CPUExecutionProvider"])
+        .get_inputs()[0]
+        .name
+    )
+
+    # Shape inference and graph cleanup make more nodes quantizable
+    preprocessed_fqfn = output_fqfn + ".pre.onnx"
+    quant_pre_process(model_fqfn, preprocessed_fqfn)
+    try:
+        quantize_static(
+            preprocessed_fqfn,
+            output_fqfn,
+            Reader(input_name, calibration_frames),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+        )
+    finally:
+        os.remove(preprocessed_fqfn)
+
+
+def convert_fp16(model_fqfn, output_fqfn):
+    import onnx
+    from onnxconverter_common import float16
+
+    model = onnx.load(model_fqfn)
+    onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), output_fqfn)
+
+
+def run_model(model, frames):
+    """Detections per frame as (label, box) lists and per frame latency in ms."""
+    detections, latencies = [], []
+    for frame in frames:
+        image = load_image(frame)
+        if image is None:
+            continue
+        start = time.perf_counter()
+        outputs = detect_objects_in_image(model, image)
+        class_ids, indices, _, original_boxes = process_yolo_output(image, outputs)
+        latencies.append((time.perf_counter() - start) * 1000)
+        detections.append(
+            [(class_label(class_ids[i]), original_boxes[i]) for i in indices]
+        )
+    return detections, latencies
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = iw * ih
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def matched_detections(reference, candidate, label, threshold=0.5):
+    """Reference detections of label found again by candidate with IoU >= threshold."""
+    matched = 0
+    for ref_frame, cand_frame in zip(reference, candidate):
+        remaining = [box for d_label, box in cand_frame if d_label == label]
+        for _, ref_box in (d for d in ref_frame if d[0] == label):
+            best = max(remaining, key=lambda box: iou(ref_box, box), default=None)
+            if best is not None and iou(ref_box, best) >= threshold:
+                matched += 1
+                remaining.remove(best)
+    return matched
+
+
+def print_report(precision, reference, reference_latency, candidate, latency):
+    reference_counts = Counter(d_label for frame in reference for d_label, _ in frame)
+    candidate_counts = Counter(d_label for frame in candidate for d_label, _ in frame)
+
+    print(f"\nfp32 vs {precision} on {len(reference)} frames")
+    print(f"{'class':>8} {'fp32':>6} {precision:>6} {'matched':>8} {'recall':>7}")
+    for label in REPORT_LABELS:
+        matched = matched_detections(reference, candidate, label)
+        total = reference_counts[label]
+        recall = f"{matched / total * 100:.1f}%" if total else "-"
+        print(
+            f"{label:>8} {total:>6} {candidate_counts[label]:>6} {matched:>8} {recall:>7}"
+        )
+
+    for name, values in (("fp32", reference_latency), (precision, latency)):
+        values = sorted(values)
+        p95 = values[int(len(values) * 0.95) - 1] if values else 0
+        print(
+            f"{name:>8} latency: mean {statistics.mean(values):.1f} ms, p95 {p95:.1f} ms"
+        )
+    print(
+        f"speedup: {statistics.mean(reference_latency) / statistics.mean(latency):.2f}x"
+        f" at confidence threshold {CONFIDENCE_THRESHOLD}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize the YOLO model")
+    parser.add_argument("--precision", choices=["int8", "fp16"], default="int8")
+    parser.add_argument(
+        "--frames",
+        nargs="*",
+        help="Folders to sample frames from. Default: processed folders of all cameras",
+    )
+    parser.add_argument("--samples", type=int, default=300)
+    parser.add_argument(
+        "--eval-fraction",
+        type=float,
+        default=0.3,
+        help="Part of the sample held out from calibration for the report",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=yolo_backend.BACKENDS.keys(),
+        default="onnxruntime",
+        help="Engine used for the report",
+    )
+    parser.add_argument("--report-only", action="store_true")
+    args = parser.parse_args()
+
+    folders = args.frames or [
+        os.path.join(CAMERAS_ROOT_PATH, folder, "processed")
+        for folder in CAMERA_FOLDERS_CONFIG
+    ]
+    frames = sample_frames(folders, args.samples)
+    if not frames:
+        parser.error(f"No frames found in {folders}")
+    eval_count = max(1, int(len(frames) * args.eval_fraction))
+    eval_frames, calibration_frames = frames[:eval_count], frames[eval_count:]
+
+    fp32_fqfn = yolo_model_fqfn("fp32")
+    quantized_fqfn = yolo_model_fqfn(args.precision)
+    if not args.report_only:
+        print(f"Writing {quantized_fqfn}")
+        if args.precision == "int8":
+            print(f"Calibrating on {len(calibration_frames)} frames")
+            quantize_int8(fp32_fqfn, quantized_fqfn, calibration_frames)
+        else:
+            convert_fp16(fp32_fqfn, quantized_fqfn)
+
+    reference, reference_latency = run_model(
+        yolo_backend.create_backend(args.backend, fp32_fqfn), eval_frames
+    )
+    candidate, latency = run_model(
+        yolo_backend.create_backend(args.backend, quantized_fqfn), eval_frames
+    )
+    print_report(args.precision, reference, reference_latency, candidate, latency)
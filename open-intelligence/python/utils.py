@@ -1,12 +1,15 @@
+import heapq
+import itertools
 import os
 import re
 import shutil
 import traceback
 from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, NamedTuple, Optional
 import numpy as np
 import cv2
+from filelock import FileLock, Timeout
 from skimage.metrics import structural_similarity as ssim
 from srFile import SrFile
 
@@ -23,18 +26,22 @@ from config import (
 
 
 class File:
-    def __init__(self, name, root_path, file_path, file_name):
-        fqfn = os.path.join(root_path, file_path, file_name)
-        if not os.path.exists(fqfn):
-            raise FileNotFoundError(
-                f"File {self.file_name} not found at {self.root_path + self.file_path}"
-            )
+    def __init__(self, name, root_path, file_path, file_name, mtime=None):
+        # mtime is known when the file comes from a directory scan, the file
+        # was seen on disk then and there is no need to stat it again
+        if mtime is None:
+            fqfn = os.path.join(root_path, file_path, file_name)
+            if not os.path.exists(fqfn):
+                raise FileNotFoundError(
+                    f"File {file_name} not found at {os.path.join(root_path, file_path)}"
+                )
         self.name = name  # Known as camera name
         self.root_path = root_path
         self.file_path = file_path
         self.file_name = file_name
+        self.mtime = mtime
         self.file_extension = self.get_file_extension(root_path, file_path, file_name)
-        self.time_stamp = self.file_create_date()
+        self.time_stamp = self.parse_create_date()
 
     def __str__(self):
         return f"{self.name} - {self.root_path} - {self.file_path} -  {self.file_name}"
@@ -45,21 +52,16 @@ class File:
         return dt.strftime("%Y_%m_%d_%H_%M_%S")
 
     def file_create_date(self) -> datetime:
+        return self.time_stamp
 
-        # 20241227103016001
-        #   %Y%m%d%H%M%S%f
-        if re.search("_\d{17}_", self.file_name):
-
-            dt_str = self.file_name.split("_")[2]
-            dt = datetime.strptime(dt_str, "%Y%m%d%H%M%S%f")
-
-        else:
-
-            dt = datetime.fromtimestamp(
-                os.path.getmtime(
+    def parse_create_date(self) -> datetime:
+        dt = parse_file_name_date(self.file_name)
+        if dt is None:
+            if self.mtime is None:
+                self.mtime = os.path.getmtime(
                     os.path.join(self.root_path, self.file_path, self.file_name)
                 )
-            )
+            dt = datetime.fromtimestamp(self.mtime)
 
         return dt
 
@@ -70,6 +72,69 @@ class File:
         return file_extension
 
 
+def parse_file_name_date(file_name: str) -> Optional[datetime]:
+    """Camera time stamp embedded in the file name, None if the name has none."""
+
+    # 20241227103016001
+    #   %Y%m%d%H%M%S%f
+    if not re.search("_\\d{17}_", file_name):
+        return None
+
+    # Same as strptime(dt_str, "%Y%m%d%H%M%S%f") without the format parsing
+    # cost, this is called for every file of a camera backlog
+    dt_str = file_name.split("_")[2]
+    return datetime(
+        int(dt_str[0:4]),
+        int(dt_str[4:6]),
+        int(dt_str[6:8]),
+        int(dt_str[8:10]),
+        int(dt_str[10:12]),
+        int(dt_str[12:14]),
+        int(dt_str[14:].ljust(6, "0")),
+    )
+
+
+def claim_file(file: File) -> Optional[FileLock]:
+    """
+    Lock a camera frame for processing without waiting.
+
+    Returns:
+        FileLock: Held lock, None when another worker or instance has the frame or
+        it is already gone because the previous lock holder processed it.
+    """
+    fqfn = os.path.join(file.root_path, file.file_path, file.file_name)
+    lock = FileLock(fqfn + ".lock")
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        return None
+
+    if not os.path.exists(fqfn):
+        release_file(lock)
+        return None
+    return lock
+
+
+def release_file(lock: FileLock):
+    """
+    Release a claim_file lock.
+
+    The lock file is only removed once its frame is gone. Removed while the frame
+    stays, a process that opened the old lock file and one creating a new one
+    could both claim the frame. With the frame gone both find nothing to do.
+    """
+    lock.release()
+    if lock.is_locked:
+        return
+    frame_fqfn = lock.lock_file[: -len(".lock")]
+    if not os.path.exists(frame_fqfn):
+        try:
+            os.remove(lock.lock_file)
+        except FileNotFoundError:
+            # Removed by the other process that found the frame gone
+            pass
+
+
 def is_label_ignored(label):
     return label in IGNORED_LABELS
 
@@ -102,6 +167,99 @@ def load_image(fqfn, record_id=None):
     return image
 
 
+# Start of frame markers carrying the image size, all SOFn but DHT, JPG and DAC
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7}
+JPEG_SOF_MARKERS |= {0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+
+# libjpeg scales during the inverse DCT, decoding at 1/2, 1/4 or 1/8 size skips
+# most of the decode work
+REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def jpeg_dimensions(data) -> Optional[tuple]:
+    """(width, height) from the frame header of JPEG file contents, None when missing."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i, end = 2, len(data)
+    while i < end:
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        while i < end and data[i] == 0xFF:
+            i += 1
+        if i >= end:
+            return None
+        marker = data[i]
+        i += 1
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        # End of image or start of scan, the frame header comes before both
+        if marker in (0xD9, 0xDA) or i + 2 > end:
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            header = data[i + 2 : i + 7]
+            if len(header) < 5:
+                return None
+            height = int.from_bytes(header[1:3], "big")
+            width = int.from_bytes(header[3:5], "big")
+            return (width, height) if width and height else None
+        i += int.from_bytes(data[i : i + 2], "big")
+    return None
+
+
+def read_file_bytes(fqfn) -> Optional[bytes]:
+    try:
+        with open(fqfn, "rb") as f:
+            return f.read()
+    except OSError as e:
+        print(f"An I/O error occurred reading {fqfn}: {e}")
+        return None
+
+
+def decode_reduced_image(data, min_width, min_height):
+    """
+    Decode image file contents at the smallest JPEG DCT scale keeping the image at
+    least min_width x min_height pixels.
+
+    Returns:
+        tuple: (image, (x scale, y scale) from the image to the full size frame).
+        Images that can't be reduced are decoded at full size with scale (1.0, 1.0),
+        image is None when the contents can't be decoded.
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    dimensions = jpeg_dimensions(data)
+    if dimensions is not None:
+        width, height = dimensions
+        for factor, flag in REDUCED_COLOR_FLAGS:
+            if width // factor < min_width or height // factor < min_height:
+                continue
+            image = cv2.imdecode(buffer, flag)
+            if image is None:
+                break
+            if (width > height) != (image.shape[1] > image.shape[0]):
+                # Rotated by its EXIF orientation while decoding
+                width, height = height, width
+            return image, (width / image.shape[1], height / image.shape[0])
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), (1.0, 1.0)
+
+
+def load_reduced_image(fqfn, min_width, min_height):
+    """decode_reduced_image for a file, the file is read once."""
+    data = read_file_bytes(fqfn)
+    if data is None:
+        return None, (1.0, 1.0)
+    image, scale = decode_reduced_image(data, min_width, min_height)
+    if image is None:
+        print(f"No image found for {fqfn}")
+    return image, scale
+
+
 def save_image(fqfn, image):
     try:
         path, _ = os.path.split(fqfn)
@@ -126,32 +284,92 @@ def crop_image(image: np.ndarray, box: np.ndarray):
     return cropped_image
 
 
+def is_skipped_file_name(file_name: str) -> bool:
+    return file_name == "Thumbs.db" or file_name.find(".lock") != -1
+
+
+class ImageEntry(NamedTuple):
+    file_name: str
+    size: int
+    mtime: float
+
+
+def scan_images(path) -> Iterator[ImageEntry]:
+    """
+    Index a folder in a single os.scandir pass.
+
+    Entry type comes from the directory listing itself and size and mtime from
+    one cached stat per entry, so callers do not need to touch the files again.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir() or is_skipped_file_name(entry.name):
+                    continue
+
+                stat = entry.stat()
+                if stat.st_size == 0:
+                    continue
+
+                yield ImageEntry(entry.name, stat.st_size, stat.st_mtime)
+            except OSError as e:
+                # Removed by another process between listing and stat
+                print(f"Error reading {entry.path}: {e}")
+
+
 def get_images(folder: str) -> List[str]:
-    files = []
-    print(CAMERAS_ROOT_PATH)
     path = os.path.join(CAMERAS_ROOT_PATH, folder)
     print("path: " + path)
-    for file_name in os.listdir(path):
-        try:
-            # print("Camera_root_path: " + str(CAMERAS_ROOT_PATH))
-            fqfn = os.path.join(CAMERAS_ROOT_PATH, folder, file_name)
-            if (
-                os.path.isdir(fqfn)
-                or file_name == "Thumbs.db"
-                or file_name.find(".lock") != -1
-                or os.path.getsize(fqfn) == 0
-            ):
-                continue
+    return [entry.file_name for entry in scan_images(path)]
 
-            # print("Processing fqfn:  " + fqfn)
-            files.append(file_name)
-        except Exception as e:
-            print(e)
-            print("Error writing " + str(fqfn))
-            print(traceback.format_exc())
+
+def has_target_extension(file_name: str, target_extention: str) -> bool:
+    _, source_extension = os.path.splitext(file_name)
+    if target_extention == "jpg" and source_extension == "jpeg":
+        return True
+    return target_extention == "all" or source_extension == target_extention
+
+
+def image_entry_time_stamp(entry: ImageEntry) -> datetime:
+    dt = parse_file_name_date(entry.file_name)
+    if dt is None:
+        dt = datetime.fromtimestamp(entry.mtime)
+    return dt
+
+
+def get_oldest_files(
+    names_folders: zip, limit: int, target_extention: str = "all"
+) -> List[File]:
+    """
+    Oldest files over all cameras, same order as get_time_sorted_files()[:limit].
+
+    Each camera folder is streamed through a bounded heap keeping its limit oldest
+    entries, the per camera results are then k-way merged. Only the selected
+    entries are turned into File objects.
+    """
+    camera_streams = []
+    for name, folder in names_folders:
+        print("Processing camera " + name)
+        entries = (
+            (image_entry_time_stamp(entry), name, folder, entry)
+            for entry in scan_images(os.path.join(CAMERAS_ROOT_PATH, folder))
+            if has_target_extension(entry.file_name, target_extention)
+        )
+        camera_streams.append(heapq.nsmallest(limit, entries, key=_first_item))
+
+    oldest = itertools.islice(heapq.merge(*camera_streams, key=_first_item), limit)
+    files = [
+        File(name, "/input", folder, entry.file_name, entry.mtime)
+        for _, name, folder, entry in oldest
+    ]
+    print("returning " + str(len(files)) + " files.")
     return files
 
 
+def _first_item(e):
+    return e[0]
+
+
 def get_time_sorted_files(
     names_folders: zip, target_extention: str = "all"
 ) -> List[File]:
@@ -159,15 +377,11 @@ def get_time_sorted_files(
 
     for name, folder in names_folders:
         print("Processing camera " + name)
-        for file_name in get_images(folder):
-            _, source_extension = os.path.splitext(file_name)
-            if target_extention == "jpg" and source_extension == "jpeg":
-                pass
-            else:
-                if target_extention != "all" and source_extension != target_extention:
-                    continue
+        for entry in scan_images(os.path.join(CAMERAS_ROOT_PATH, folder)):
+            if not has_target_extension(entry.file_name, target_extention):
+                continue
 
-            file_object = File(name, "/input", folder, file_name)
+            file_object = File(name, "/input", folder, entry.file_name, entry.mtime)
             time_sorted_files.append(file_object)
 
     sz = len(time_sorted_files)
@@ -230,11 +444,16 @@ def process_image_objects(similarity_image_objects, threshold):
     Args:
         similarity_image_objects (list): List of SimilarityObject instances to process.
 
+    Rows of removed images are deleted and the compared rows marked checked in
+    batches once the pass is done.
+
     Returns:
         int: Count of processed records.
     """
     size = len(similarity_image_objects)
     count = 0
+    deleted_ids = []
+    checked_ids = []
     if size > 1:
         for i in range(size - 1):
             so1 = similarity_image_objects[i]
@@ -248,7 +467,7 @@ def process_image_objects(similarity_image_objects, threshold):
                         so1.input_image, so1
                     )
                 )
-                database.delete_row(so1.id)
+                deleted_ids.append(so1.id)
                 if os.path.exists(so1.input_image):
                     os.remove(so1.input_image)
                 count += 1
@@ -272,7 +491,7 @@ def process_image_objects(similarity_image_objects, threshold):
                         )
                     )
                     so2.output_image = 0
-                    database.delete_row(so2.id)
+                    deleted_ids.append(so2.id)
                     if os.path.exists(so2.input_image):
                         os.remove(so2.input_image)
                     count += 1
@@ -282,10 +501,13 @@ def process_image_objects(similarity_image_objects, threshold):
                 if sim > threshold:
                     count += 1
                     last_similar = j
-                    handle_similar_image(so2, so1, sim)
+                    if handle_similar_image(so2, so1, sim):
+                        deleted_ids.append(so2.id)
 
-            database.update_similarity_check_row_checked(so1.id)
+            checked_ids.append(so1.id)
 
+    database.delete_rows(deleted_ids)
+    database.update_similarity_check_rows_checked(checked_ids)
     return count
 
 
@@ -311,6 +533,7 @@ def should_break_comparison(so2, so1, j, i, last_similar, la):
 
 
 def handle_similar_image(so2, so1, sim):
+    """Removes the image of so2, returns True when its row should be deleted."""
     try:
         if DELETE_FILES:
             os.remove(so2.input_image)
@@ -320,11 +543,12 @@ def handle_similar_image(so2, so1, sim):
             if os.path.exists(fqfn):
                 os.remove(fqfn)
 
-        database.delete_row(so2.id)
         so2.output_image = 0
+        return True
     except Exception as e:
         print(e)
         print(traceback.format_exc())
+        return False
 
 
 def is_null_empty_or_whitespace(input_variable) -> bool:
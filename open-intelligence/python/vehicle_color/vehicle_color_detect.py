@@ -1,24 +1,34 @@
 import numpy as np
 import cv2
-from keras.models import load_model
-import tensorflow as tf
 import os
 
+import model_registry
 from utils import get_images, load_image
 
 labels = ['black', 'blue', 'brown', 'green', 'pink', 'red', 'silver', 'white', 'yellow']
 
-# Set Keras TensorFlow session config
-config = tf.compat.v1.ConfigProto()
-config.gpu_options.allow_growth = True
-tf_session = tf.compat.v1.Session(config=config)
-tf.compat.v1.keras.backend.set_session(tf_session)
+
+def load_color_model():
+    # TensorFlow is imported with the model, not when this module is imported
+    import tensorflow as tf
+    from keras.models import load_model
+
+    # Set Keras TensorFlow session config
+    config = tf.compat.v1.ConfigProto()
+    config.gpu_options.allow_growth = True
+    tf_session = tf.compat.v1.Session(config=config)
+    tf.compat.v1.keras.backend.set_session(tf_session)
+
+    # init of keras model for color recognition
+    return load_model(os.getcwd() + '/models/color_model.h5')  # color_weights.hdf5
+
+
+model_registry.register('vehicle_color', load_color_model, remote=True)
 
 
 def detect_color(input_image_path_label_file_name):
     try:
-        # init of keras model for color recognition
-        model = load_model(os.getcwd() + '/models/color_model.h5')  # color_weights.hdf5
+        model = model_registry.get('vehicle_color')
 
         # Load image
         input_image = load_image(input_image_path_label_file_name)
@@ -38,8 +48,7 @@ def detect_color(input_image_path_label_file_name):
 
 # For testing
 def detect_colors_from_folder(input_image_folder):
-    # init of keras model for color recognition
-    model = load_model(os.getcwd() + '/models/color_model.h5')  # color_weights.hdf5
+    model = model_registry.get('vehicle_color')
 
     files = get_images(input_image_folder)
 
@@ -0,0 +1,122 @@
+"""Inference engines able to run the YOLO ONNX models on CPU.
+
+All backends take a preprocessed NCHW float32 blob and return the raw model
+outputs as a list of numpy arrays, the same thing cv2.dnn.Net.forward returns.
+"""
+
+import cv2
+
+
+class OpenCVBackend:
+    """cv2.dnn with the OpenCV CPU backend."""
+
+    def __init__(self, model_fqfn, intra_op_threads=0, inter_op_threads=0, **_):
+        self.net = cv2.dnn.readNetFromONNX(model_fqfn)
+        if self.net.empty():
+            raise RuntimeError("Failed to load YOLO model")
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        if intra_op_threads > 0:
+            # OpenCV has a single process wide thread pool
+            cv2.setNumThreads(intra_op_threads)
+        self.output_names = self.net.getUnconnectedOutLayersNames()
+
+    def forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward(self.output_names)
+
+
+class OnnxRuntimeBackend:
+    """onnxruntime with the CPUExecutionProvider."""
+
+    OPTIMIZATION_LEVELS = {
+        "disabled": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+
+    def __init__(
+        self,
+        model_fqfn,
+        intra_op_threads=0,
+        inter_op_threads=0,
+        graph_optimization="all",
+    ):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = getattr(
+            onnxruntime.GraphOptimizationLevel,
+            self.OPTIMIZATION_LEVELS[graph_optimization],
+        )
+        self.session = onnxruntime.InferenceSession(
+            model_fqfn, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, blob):
+        return self.session.run(None, {self.input_name: blob})
+
+
+class OpenVinoBackend:
+    """OpenVINO runtime on the CPU device."""
+
+    def __init__(
+        self,
+        model_fqfn,
+        intra_op_threads=0,
+        inter_op_threads=0,
+        graph_optimization="all",
+    ):
+        import openvino
+
+        core = openvino.Core()
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if intra_op_threads > 0:
+            config["INFERENCE_NUM_THREADS"] = intra_op_threads
+        if inter_op_threads > 0:
+            config["NUM_STREAMS"] = inter_op_threads
+        # OpenVINO always applies its own graph transformations, there is no
+        # equivalent of the onnxruntime optimization levels
+        self.compiled_model = core.compile_model(
+            core.read_model(model_fqfn), "CPU", config
+        )
+        self.request = self.compiled_model.create_infer_request()
+
+    def forward(self, blob):
+        results = self.request.infer({0: blob})
+        return [results[output] for output in self.compiled_model.outputs]
+
+
+BACKENDS = {
+    "opencv": OpenCVBackend,
+    "onnxruntime": OnnxRuntimeBackend,
+    "openvino": OpenVinoBackend,
+}
+
+
+def create_backend(
+    name,
+    model_fqfn,
+    intra_op_threads=0,
+    inter_op_threads=0,
+    graph_optimization="all",
+):
+    if name not in BACKENDS:
+        raise ValueError(f"Unsupported YOLO backend: {name}")
+
+    print(
+        f"Loading {model_fqfn} with {name} backend, "
+        f"threads {intra_op_threads}/{inter_op_threads}, optimization {graph_optimization}"
+    )
+    return BACKENDS[name](
+        model_fqfn,
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+        graph_optimization=graph_optimization,
+    )